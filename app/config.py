@@ -1,9 +1,43 @@
+import os
 from pathlib import Path
 
 
 class _Config:
     def __init__(self):
         self._root_dir: Path = Path("app")
+        self._default_page_size: int = 100
+        self._max_page_size: int = int(os.environ.get("MAX_PAGE_SIZE", 1000))
+        self._bulk_chunk_size: int = 1000 #righe per transazione negli endpoint bulk e per lettura negli export
+        self._fast_json: bool = os.environ.get("FAST_JSON", "true").lower() in ("1", "true", "yes") #le liste vengono serializzate direttamente dalle colonne, senza i modelli Pydantic
+        self._cache_enabled: bool = os.environ.get("CACHE_ENABLED", "true").lower() in ("1", "true", "yes") #cache delle letture degli eventi
+        self._cache_max_entries: int = int(os.environ.get("CACHE_MAX_ENTRIES", 1024))
+        self._cache_ttl: float = float(os.environ.get("CACHE_TTL", 60)) #secondi
+        self._sse_queue_size: int = int(os.environ.get("SSE_QUEUE_SIZE", 100)) #messaggi in attesa per client SSE prima di un resync
+        self._sse_heartbeat: float = float(os.environ.get("SSE_HEARTBEAT", 15)) #secondi di inattività dopo cui gli stream SSE inviano un commento
+        #Profilo del motore del database, sovrascrivibile tramite variabili d'ambiente
+        self._database_url: str | None = os.environ.get("DATABASE_URL") #se assente si usa il file SQLite in data/database.db
+        self._db_echo: bool = os.environ.get("DB_ECHO", "false").lower() in ("1", "true", "yes")
+        self._db_pool_size: int = int(os.environ.get("DB_POOL_SIZE", 10))
+        self._db_max_overflow: int = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+        self._db_pool_timeout: float = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+        self._db_async: bool = os.environ.get("DB_ASYNC", "false").lower() in ("1", "true", "yes") #sceglie tra motore sincrono e asincrono
+        self._async_database_url: str | None = os.environ.get("ASYNC_DATABASE_URL") #se assente viene derivato da database_url
+        #Strumentazione delle richieste e delle query SQL, esposta su /metrics
+        self._metrics_enabled: bool = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+        self._server_timing: bool = os.environ.get("SERVER_TIMING", "false").lower() in ("1", "true", "yes") #aggiunge l'header Server-Timing alle risposte
+        self._slow_query_ms: float = float(os.environ.get("SLOW_QUERY_MS", 100)) #oltre questa durata una query viene registrata come lenta
+        self._n_plus_one_threshold: int = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 10)) #esecuzioni della stessa query in una richiesta che indicano un N+1
+        #Coda di scrittura: le modifiche di più richieste vengono eseguite da un solo task e confermate con un unico commit
+        self._write_coalescing: bool = os.environ.get("WRITE_COALESCING", "false").lower() in ("1", "true", "yes")
+        self._write_batch_window_ms: float = float(os.environ.get("WRITE_BATCH_WINDOW_MS", 0)) #attesa massima di altre scritture prima del commit di un gruppo (0: si confermano quelle già in coda)
+        self._write_batch_max: int = int(os.environ.get("WRITE_BATCH_MAX", 256)) #scritture al massimo in un solo commit
+        self._sqlite_pragmas: dict[str, str] = { #applicati ad ogni nuova connessione SQLite
+            "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"), #i lettori non vengono bloccati dallo scrittore
+            "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"), #con WAL NORMAL è sicuro e evita un fsync per commit
+            "cache_size": os.environ.get("SQLITE_CACHE_SIZE", "-65536"), #valore negativo = KiB, quindi 64 MiB di cache per connessione
+            "mmap_size": os.environ.get("SQLITE_MMAP_SIZE", "268435456"), #256 MiB letti tramite memory mapping
+            "busy_timeout": os.environ.get("SQLITE_BUSY_TIMEOUT", "5000"), #millisecondi di attesa sui lock prima di "database is locked"
+        }
 
     @property
     def root_dir(self) -> Path:
@@ -13,5 +47,173 @@ class _Config:
     def root_dir(self, value: str | Path) -> None:
         self._root_dir = Path(value)
 
+    @property
+    def default_page_size(self) -> int:
+        return self._default_page_size
+
+    @default_page_size.setter
+    def default_page_size(self, value: int) -> None:
+        self._default_page_size = int(value)
+
+    @property
+    def max_page_size(self) -> int:
+        return self._max_page_size
+
+    @max_page_size.setter
+    def max_page_size(self, value: int) -> None:
+        self._max_page_size = int(value)
+
+    @property
+    def bulk_chunk_size(self) -> int:
+        return self._bulk_chunk_size
+
+    @bulk_chunk_size.setter
+    def bulk_chunk_size(self, value: int) -> None:
+        self._bulk_chunk_size = int(value)
+
+    @property
+    def fast_json(self) -> bool:
+        return self._fast_json
+
+    @fast_json.setter
+    def fast_json(self, value: bool) -> None:
+        self._fast_json = bool(value)
+
+    @property
+    def cache_enabled(self) -> bool:
+        return self._cache_enabled
+
+    @cache_enabled.setter
+    def cache_enabled(self, value: bool) -> None:
+        self._cache_enabled = bool(value)
+
+    @property
+    def cache_max_entries(self) -> int:
+        return self._cache_max_entries
+
+    @property
+    def cache_ttl(self) -> float:
+        return self._cache_ttl
+
+    @property
+    def sse_queue_size(self) -> int:
+        return self._sse_queue_size
+
+    @property
+    def sse_heartbeat(self) -> float:
+        return self._sse_heartbeat
+
+    @sse_heartbeat.setter
+    def sse_heartbeat(self, value: float) -> None:
+        self._sse_heartbeat = float(value)
+
+    @property
+    def database_url(self) -> str:
+        return self._database_url or f"sqlite:///{self._root_dir / 'data/database.db'}"
+
+    @database_url.setter
+    def database_url(self, value: str | None) -> None:
+        self._database_url = value
+
+    @property
+    def db_echo(self) -> bool:
+        return self._db_echo
+
+    @db_echo.setter
+    def db_echo(self, value: bool) -> None:
+        self._db_echo = bool(value)
+
+    @property
+    def db_pool_size(self) -> int:
+        return self._db_pool_size
+
+    @db_pool_size.setter
+    def db_pool_size(self, value: int) -> None:
+        self._db_pool_size = int(value)
+
+    @property
+    def db_max_overflow(self) -> int:
+        return self._db_max_overflow
+
+    @db_max_overflow.setter
+    def db_max_overflow(self, value: int) -> None:
+        self._db_max_overflow = int(value)
+
+    @property
+    def db_pool_timeout(self) -> float:
+        return self._db_pool_timeout
+
+    @db_pool_timeout.setter
+    def db_pool_timeout(self, value: float) -> None:
+        self._db_pool_timeout = float(value)
+
+    @property
+    def db_async(self) -> bool:
+        return self._db_async
+
+    @db_async.setter
+    def db_async(self, value: bool) -> None:
+        self._db_async = bool(value)
+
+    @property
+    def async_database_url(self) -> str | None:
+        return self._async_database_url
+
+    @async_database_url.setter
+    def async_database_url(self, value: str | None) -> None:
+        self._async_database_url = value
+
+    @property
+    def metrics_enabled(self) -> bool:
+        return self._metrics_enabled
+
+    @property
+    def server_timing(self) -> bool:
+        return self._server_timing
+
+    @server_timing.setter
+    def server_timing(self, value: bool) -> None:
+        self._server_timing = bool(value)
+
+    @property
+    def slow_query_ms(self) -> float:
+        return self._slow_query_ms
+
+    @slow_query_ms.setter
+    def slow_query_ms(self, value: float) -> None:
+        self._slow_query_ms = float(value)
+
+    @property
+    def n_plus_one_threshold(self) -> int:
+        return self._n_plus_one_threshold
+
+    @n_plus_one_threshold.setter
+    def n_plus_one_threshold(self, value: int) -> None:
+        self._n_plus_one_threshold = int(value)
+
+    @property
+    def write_coalescing(self) -> bool:
+        return self._write_coalescing
+
+    @property
+    def write_batch_window_ms(self) -> float:
+        return self._write_batch_window_ms
+
+    @write_batch_window_ms.setter
+    def write_batch_window_ms(self, value: float) -> None:
+        self._write_batch_window_ms = float(value)
+
+    @property
+    def write_batch_max(self) -> int:
+        return self._write_batch_max
+
+    @write_batch_max.setter
+    def write_batch_max(self, value: int) -> None:
+        self._write_batch_max = int(value)
+
+    @property
+    def sqlite_pragmas(self) -> dict[str, str]:
+        return self._sqlite_pragmas
+
 
 config: _Config = _Config()
@@ -0,0 +1,60 @@
+import asyncio #code dei sottoscrittori, consumate dagli stream SSE nell'event loop
+from app.config import config
+
+RESYNC = "resync" #messaggio inviato a un sottoscrittore che è rimasto indietro e ha perso dei messaggi
+#Messaggi pubblicati sulle modifiche di un evento
+REGISTRATIONS_ADDED = "registrations_added" #{"event_id": ..., "usernames": [...]}
+REGISTRATIONS_REMOVED = "registrations_removed" #{"event_id": ..., "usernames": [...]}
+EVENT_UPDATED = "event_updated" #l'evento aggiornato
+EVENT_DELETED = "event_deleted" #{"id": ...}
+
+
+class Subscription: #Coda dei messaggi di un singolo client
+    def __init__(self, topic: object, size: int):
+        self.topic = topic
+        self.queue: asyncio.Queue[tuple[str, dict]] = asyncio.Queue(size) #limitata, così un client lento non fa crescere la memoria
+
+    def offer(self, message: tuple[str, dict]) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull: #il client non sta al passo: i messaggi in coda vengono scartati e sostituiti da un resync
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((RESYNC, {}))
+
+    async def get(self) -> tuple[str, dict]:
+        return await self.queue.get()
+
+
+class Broker:
+    """In-process fan-out of change messages to the subscribers of a topic (e.g. an event id).
+    Each subscriber has a bounded queue: when it overflows, its pending messages are replaced by a single "resync" message,
+    telling the client to reload the current state. Publishing never blocks. Messages only reach subscribers of this process"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscriptions: dict[object, set[Subscription]] = {} #topic -> sottoscrittori
+
+    def subscribe(self, topic: object) -> Subscription:
+        subscription = Subscription(topic, self.queue_size)
+        self._subscriptions.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscriptions.get(subscription.topic)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscriptions[subscription.topic]
+
+    def publish(self, topic: object, name: str, data: dict) -> None:
+        """Sends the message (name, data) to every subscriber of topic"""
+        for subscription in self._subscriptions.get(topic, ()):
+            subscription.offer((name, data))
+
+    def topics(self) -> list:
+        """Returns the topics that have at least one subscriber"""
+        return list(self._subscriptions)
+
+
+event_broker: Broker = Broker(config.sse_queue_size) #modifiche agli eventi e alle loro registrazioni, per argomento = id dell'evento
@@ -0,0 +1,89 @@
+import json #per leggere le righe NDJSON e scrivere quelle dell'export
+from typing import AsyncIterator #per annotare i generatori asincroni
+from fastapi import HTTPException, Request #Request per leggere il corpo della richiesta come stream
+from fastapi.responses import StreamingResponse #per inviare l'export un pezzo alla volta
+from pydantic import ValidationError #sollevata quando una riga non rispetta il modello
+from sqlmodel import SQLModel, select
+from app.config import config
+from app.data.db import new_async_session #l'export apre una propria sessione, che resta aperta per tutta la durata dello stream
+from app.data.pagination import keyset_condition #condizione di keyset usata per leggere la tabella a pezzi
+from app.metrics import chunked_queries #la query di ogni pezzo è la stessa, non va segnalata come N+1
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+async def read_rows(request: Request) -> AsyncIterator[tuple[int, object]]:
+    """Yields (row number, parsed item) for a JSON array or an NDJSON body.
+    NDJSON bodies are read line by line as they arrive; a line that is not valid JSON is yielded as a ValueError"""
+    if "ndjson" not in request.headers.get("content-type", ""):
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="The body must be a JSON array or an NDJSON stream") #400->Bad Request
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="The body must be a JSON array or an NDJSON stream")
+        for row, item in enumerate(items):
+            yield row, item
+        return
+    row, buffer = 0, b""
+    async for data in request.stream(): #il corpo arriva a pezzi, le righe possono essere spezzate tra un pezzo e l'altro
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield row, _parse_line(line)
+                row += 1
+    if buffer.strip(): #ultima riga senza "\n" finale
+        yield row, _parse_line(buffer)
+
+
+def _parse_line(line: bytes) -> object:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+async def validated_chunks(request: Request, model: type[SQLModel], errors: list[dict]) -> AsyncIterator[list[tuple[int, SQLModel]]]:
+    """Validates each row of the body against model and yields the valid ones in chunks of config.bulk_chunk_size.
+    Invalid rows are appended to errors"""
+    chunk = []
+    async for row, item in read_rows(request):
+        try:
+            if isinstance(item, ValueError):
+                raise item
+            chunk.append((row, model.model_validate(item)))
+        except ValidationError as e:
+            errors.append(row_error(row, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())))
+        except ValueError as e:
+            errors.append(row_error(row, f"Invalid JSON: {e}"))
+        if len(chunk) >= config.bulk_chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def row_error(row: int, detail: str) -> dict: #formato degli errori per riga restituiti dagli endpoint bulk
+    return {"row": row, "detail": detail}
+
+
+def ndjson_export(model: type[SQLModel], columns: list) -> StreamingResponse:
+    """Streams all rows of model as NDJSON, reading the table in keyset-ordered chunks so memory use does not grow with the table"""
+    async def lines():
+        session = new_async_session()
+        try:
+            last = None
+            while True:
+                statement = select(model)
+                if last is not None: #riparte dalla chiave dell'ultima riga inviata
+                    statement = statement.where(keyset_condition(columns, last, descending=False))
+                with chunked_queries(): #non attraversa lo yield: il generatore potrebbe essere chiuso da un altro contesto
+                    rows = (await session.exec(statement.order_by(*columns).limit(config.bulk_chunk_size))).all()
+                if not rows:
+                    break
+                yield "".join(row.model_dump_json() + "\n" for row in rows)
+                last = [getattr(rows[-1], column.key) for column in columns]
+        finally:
+            await session.close()
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
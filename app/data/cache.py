@@ -0,0 +1,178 @@
+import hashlib #per calcolare l'ETag a partire dal corpo della risposta
+import threading #il backend in memoria può essere usato anche dai thread del threadpool
+import time
+from abc import ABC, abstractmethod #per definire l'interfaccia dei backend della cache
+from collections import OrderedDict #mantiene l'ordine di utilizzo delle chiavi, per l'eviction LRU
+from email.utils import formatdate, parsedate_to_datetime #formato delle date HTTP usato da Last-Modified e If-Modified-Since
+from typing import Awaitable, Callable
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.config import config
+
+
+class CachedResponse: #Risposta già serializzata, con i metadati per la validazione condizionale
+    def __init__(self, body: bytes, headers: dict[str, str], last_modified: float):
+        self.body = body
+        self.headers = headers
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.last_modified = last_modified
+
+
+class CacheBackend(ABC):
+    """Interface of the storage used by ResponseCache. Implement it to keep the cache outside the process (e.g. Redis).
+    Besides the responses it keeps the time each scope was last modified, so that all the processes sharing the backend
+    send the same Last-Modified and no process serves a response built before another process invalidated it"""
+
+    @abstractmethod
+    def get(self, key: str) -> CachedResponse | None: ...
+
+    @abstractmethod
+    def get_modified(self, key: str) -> float | None: ...
+
+    @abstractmethod
+    def set_modified(self, key: str, value: float) -> None: ...
+
+    @abstractmethod
+    def set(self, key: str, value: CachedResponse) -> None: ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str) -> None: ... #elimina le risposte e gli istanti di modifica delle chiavi con il prefisso
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process backend with LRU eviction beyond max_entries and a TTL in seconds on every entry"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, CachedResponse]] = OrderedDict() #chiave -> (scadenza, risposta)
+        self._modified: dict[str, float] = {} #chiave -> istante dell'ultima modifica, senza scadenza
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic(): #scaduta
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key) #usata di recente
+            return entry[1]
+
+    def get_modified(self, key: str) -> float | None:
+        with self._lock:
+            return self._modified.get(key)
+
+    def set_modified(self, key: str, value: float) -> None:
+        with self._lock:
+            self._modified[key] = value
+
+    def set(self, key: str, value: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries: #elimina le chiavi usate meno di recente
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+            for key in [key for key in self._modified if key.startswith(prefix)]:
+                del self._modified[key]
+
+
+class ResponseCache:
+    """Read-through cache of JSON responses, grouped by scope (e.g. "events:list", "events:item:1") within a namespace.
+    Each scope remembers in the backend when it was last invalidated, which is used as Last-Modified"""
+
+    def __init__(self, backend: CacheBackend, namespace: str):
+        self.backend = backend #può essere sostituito con un altro CacheBackend
+        self.namespace = namespace #prefisso comune a tutti gli scope, svuotato da invalidate_all
+
+    def last_modified(self, scope: str) -> float:
+        modified = self.backend.get_modified(scope) or self.backend.get_modified(self.namespace) #lo scope, o l'ultima invalidazione completa
+        if modified is None: #nessuna invalidazione registrata nel backend (ad esempio all'avvio): il namespace risulta modificato ora
+            modified = time.time()
+            self.backend.set_modified(self.namespace, modified)
+        return modified
+
+    def invalidate(self, *scopes: str) -> None:
+        """Drops every cached response of the given scopes and marks them as modified now"""
+        now = time.time()
+        for scope in scopes:
+            self.backend.set_modified(scope, now)
+            self.backend.delete_prefix(scope + "?") #il "?" evita che events:item:1 invalidi anche events:item:10
+
+    def invalidate_all(self) -> None:
+        """Drops every cached response of the namespace and marks all its scopes as modified now"""
+        self.backend.delete_prefix(self.namespace) #anche gli istanti di modifica dei singoli scope
+        self.backend.set_modified(self.namespace, time.time())
+
+    async def respond(self, request: Request, scope: str, build: Callable[[Response], Awaitable[object]]) -> Response:
+        """Returns the cached response for the request, building it with build on a miss.
+        build receives a Response on which it can set headers that are cached with the body.
+        build can also return a Response with an already serialized body, whose X- headers are cached; a StreamingResponse is returned as is, without caching it.
+        Answers 304 when the request's If-None-Match or If-Modified-Since show the client copy is still valid"""
+        key = f"{scope}?{request.url.query}" #le risposte di una lista dipendono dai parametri della query string
+        last_modified = self.last_modified(scope) #letto prima della query, così un'invalidazione concorrente non viene persa
+        cached = self.backend.get(key) if config.cache_enabled else None
+        if cached is not None and cached.last_modified != last_modified:
+            #costruita prima dell'ultima invalidazione (ad esempio memorizzata da un altro processo mentre questa avveniva)
+            cached = None
+        if cached is None:
+            headers = Response()
+            content = await build(headers)
+            if isinstance(content, StreamingResponse): #pagine troppo grandi per essere tenute in memoria
+                return content
+            if isinstance(content, Response): #corpo già serializzato
+                headers = content
+            cached = CachedResponse(
+                headers.body if headers is content else JSONResponse(jsonable_encoder(content)).body,
+                {name: value for name, value in headers.headers.items() if name.lower().startswith("x-")},
+                last_modified,
+            )
+            if config.cache_enabled: #se nel frattempo lo scope è stato invalidato, la risposta verrà scartata alla prossima lettura
+                self.backend.set(key, cached)
+        headers = {
+            **cached.headers,
+            "ETag": cached.etag,
+            "Last-Modified": formatdate(_last_modified_second(cached.last_modified), usegmt=True),
+            "Cache-Control": "no-cache", #il browser può conservare la risposta ma deve rivalidarla ad ogni uso
+        }
+        if _not_modified(request, cached):
+            return Response(status_code=304, headers=headers)
+        return Response(cached.body, media_type="application/json", headers=headers)
+
+
+def _last_modified_second(last_modified: float) -> int:
+    #Le date HTTP hanno la precisione del secondo: due modifiche nello stesso secondo avrebbero lo stesso Last-Modified.
+    #Se il secondo della modifica è già trascorso si invia il secondo successivo, a cui ogni modifica futura sarà posteriore;
+    #altrimenti il secondo della modifica, che con il confronto stretto di _not_modified non produce mai un 304
+    following = int(last_modified) + 1
+    return following if following <= time.time() else int(last_modified)
+
+
+def _not_modified(request: Request, cached: CachedResponse) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None: #If-None-Match ha la precedenza su If-Modified-Since
+        return if_none_match.strip() == "*" or cached.etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return cached.last_modified < parsedate_to_datetime(if_modified_since).timestamp() #vedi _last_modified_second
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+event_cache: ResponseCache = ResponseCache(MemoryCacheBackend(config.cache_max_entries, config.cache_ttl), "events:") #cache delle letture degli eventi
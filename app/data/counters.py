@@ -0,0 +1,97 @@
+"""Per-event registration counters, updated in the same transaction as the registrations they count.
+
+Compare the counters with the registrations, or rebuild them from the registrations, from the project root with:
+    python -m app.data.counters --check
+    python -m app.data.counters --rebuild
+"""
+import argparse #per leggere i parametri da riga di comando
+import sys
+from sqlalchemy import Connection, Integer, cast, delete, func, insert, select
+from app.data.cache import event_cache #le risposte con i conteggi vanno invalidate quando i contatori cambiano
+from app.data.db import dialect_name, insert_or_add
+from app.models.event import EventCounter
+from app.models.registration import Registration
+
+#Scope della cache delle risposte che mostrano i conteggi, separati da quelli senza conteggi, che così non vengono invalidati ad ogni registrazione
+COUNTS_LIST_SCOPE = "events:counts:list"
+STATS_SCOPE = "events:stats"
+
+registrations_count = func.coalesce(EventCounter.registrations, 0).label("registrations") #0 per gli eventi che non hanno ancora un contatore
+
+_BUCKET_FORMATS = { #formato della data che identifica un intervallo, per dialetto
+    "sqlite": {"day": "%Y-%m-%d", "month": "%Y-%m", "year": "%Y"}, #settimana: vedi date_bucket
+    "postgresql": {"day": "YYYY-MM-DD", "week": "IYYY-\"W\"IW", "month": "YYYY-MM", "year": "YYYY"},
+    "mysql": {"day": "%Y-%m-%d", "week": "%x-W%v", "month": "%Y-%m", "year": "%Y"},
+}
+
+
+def counts_item_scope(id: int) -> str:
+    return f"events:counts:item:{id}"
+
+
+def date_bucket(column, bucket: str):
+    """Returns an expression that formats the date column as the day, ISO week, month or year it belongs to (e.g. "2026-05", "2026-W01")"""
+    if dialect_name == "sqlite":
+        if bucket == "week": #settimana ISO, come in PostgreSQL e MySQL: %V e %G esistono solo da SQLite 3.46
+            thursday = func.date(column, "-3 days", "weekday 4") #il giovedì della settimana (da lunedì a domenica) determina anno e numero ISO
+            return func.printf("%s-W%02d", func.strftime("%Y", thursday), (cast(func.strftime("%j", thursday), Integer) - 1) // 7 + 1)
+        return func.strftime(_BUCKET_FORMATS["sqlite"][bucket], column)
+    if dialect_name == "postgresql":
+        return func.to_char(column, _BUCKET_FORMATS["postgresql"][bucket])
+    return func.date_format(column, _BUCKET_FORMATS["mysql"][bucket])
+
+
+async def add_registrations(session, deltas: dict[int, int]) -> None:
+    """Adds deltas (event id -> registrations added, negative when removed) to the counters, within the transaction of session"""
+    rows = [{"event_id": id, "registrations": delta} for id, delta in deltas.items() if delta]
+    if rows:
+        await session.exec(insert_or_add(EventCounter, [EventCounter.event_id], EventCounter.registrations), params=rows)
+
+
+def invalidate_counts(event_ids=()) -> None:
+    """Drops the cached responses that show the counters of the given events, and the cached lists and statistics"""
+    event_cache.invalidate(COUNTS_LIST_SCOPE, STATS_SCOPE, *(counts_item_scope(id) for id in event_ids))
+
+
+def _registrations_per_event():
+    return select(Registration.event_id, func.count()).group_by(Registration.event_id)
+
+
+def check_counters(connection: Connection) -> list[dict]:
+    """Returns the events whose counter differs from the number of their registrations, with both values"""
+    stored = dict(connection.execute(select(EventCounter.event_id, EventCounter.registrations)).all())
+    actual = dict(connection.execute(_registrations_per_event()).all())
+    return [
+        {"event_id": id, "counter": stored.get(id, 0), "registrations": actual.get(id, 0)}
+        for id in sorted(stored.keys() | actual.keys())
+        if stored.get(id, 0) != actual.get(id, 0)
+    ]
+
+
+def rebuild_counters(connection: Connection) -> int:
+    """Recomputes every counter from the registrations. Returns the number of events with registrations"""
+    connection.execute(delete(EventCounter))
+    return connection.execute(insert(EventCounter).from_select(["event_id", "registrations"], _registrations_per_event())).rowcount
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--check", action="store_true", help="list the counters that differ from the registrations; exit status 1 if any")
+    action.add_argument("--rebuild", action="store_true", help="recompute all counters from the registrations")
+    args = parser.parse_args()
+    from app.data.db import engine, init_database #il database è quello configurato (DATABASE_URL o data/database.db)
+    init_database(with_fake_data=False)
+    with engine.begin() as connection: #la lettura o la ricostruzione avvengono in una sola transazione
+        if args.rebuild:
+            print(f"{rebuild_counters(connection)} counters rebuilt")
+            return
+        drift = check_counters(connection)
+    for row in drift:
+        print(f"event {row['event_id']}: counter {row['counter']}, registrations {row['registrations']}")
+    print(f"{len(drift)} counters differ from the registrations")
+    sys.exit(1 if drift else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,41 +2,129 @@ from sqlmodel import create_engine, SQLModel, Session
 #Create_engine: funzione per creare una connessione al database
 #SQLModel: classe base da cui derivare i modelli che rappresentano le tabelle nel database
 #Session: oggetto per aprire una "sessione" sul database
+from sqlalchemy import event, inspect, make_url #event per registrare i pragma sulle nuove connessioni, inspect per controllare le tabelle esistenti
+from sqlalchemy import insert as sa_insert
+from sqlalchemy.pool import QueuePool #il pool predefinito, l'unico che accetta pool_size, max_overflow e pool_timeout
+from sqlalchemy.dialects import mysql, postgresql, sqlite #INSERT con ON CONFLICT specifico del dialetto
+from sqlalchemy.ext.asyncio import create_async_engine #motore asincrono, usato quando config.db_async è attivo
+from sqlmodel.ext.asyncio.session import AsyncSession #sessione asincrona di SQLModel
 from typing import Annotated #per annotare tipi
 from fastapi import Depends #per dichiarare dipendenze nei path operation di FastAPI
-import os #libreria standard di Python per operazioni sul filesystem
-from faker import Faker #Libreria per generare dati fittizi con cui riempire in database. Utili sopratutto in fase di test.
+from starlette.concurrency import run_in_threadpool #per eseguire le chiamate bloccanti della sessione sincrona fuori dall'event loop
 from app.config import config
+from app.metrics import instrument_engine #misura le query SQL e le attribuisce alla richiesta HTTP in corso
+from app.data.search import init_event_search
+from app.data.seed import seed_database #genera dati fittizi (con Faker) per popolare il database
 # TODO: remember to import all the DB models here
 from app.models.registration import Registration  #import necessario per utilizzare la classe Registration definita nel package models nel file python registration.py
 from app.models.user import User #import necessario per usare la classe User definita nel package models nel file python user.py
-from app.models.event import Event #import necessario per usare la classe Event definita nel package models nel file python event.py
+from app.models.event import Event, EventCounter #import necessario per usare la classe Event definita nel package models nel file python event.py
 
-sqlite_file_name = config.root_dir / "data/database.db" #Costruisce il percorso assoluto al file del database basandosi sulla root del progetto
-sqlite_url = f"sqlite:///{sqlite_file_name}" #crea la stringa URL di connessione al database
-connect_args = {"check_same_thread": False} #per applicazioni multithread
-engine = create_engine(sqlite_url, connect_args=connect_args, echo=True) #crea il motore di connessione al database: specifica dove si trova il database, le opzioni di connessione, echo=True: fa in modo che ogni query SQL venga stampata sulla console (utile per il debug).
+database_url = config.database_url #URL di connessione: il file SQLite in data/database.db (relativo alla root del progetto) oppure quello indicato in DATABASE_URL
+dialect_name = make_url(database_url).get_backend_name() #ad esempio "sqlite" o "postgresql", per le funzionalità specifiche di un database
+
+
+_ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"} #driver asincroni usati quando ASYNC_DATABASE_URL non è indicato
+
+
+def _async_url(url: str) -> str: #ricava l'URL asincrono da quello sincrono, ad esempio sqlite:/// -> sqlite+aiosqlite:///
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    return parsed.set(drivername=f"{backend}+{_ASYNC_DRIVERS.get(backend, parsed.get_driver_name())}").render_as_string(hide_password=False)
+
+
+def _engine_options(url: str) -> dict: #opzioni comuni ai motori sincrono e asincrono
+    parsed = make_url(url)
+    is_sqlite = parsed.get_backend_name() == "sqlite"
+    options = dict(
+        echo=config.db_echo, #con DB_ECHO=true ogni query SQL viene stampata sulla console (utile per il debug)
+        connect_args={"check_same_thread": False} if is_sqlite else {}, #per applicazioni multithread
+        pool_pre_ping=not is_sqlite, #verifica le connessioni di rete prima di riusarle
+    )
+    #il dimensionamento vale solo per QueuePool: SQLite in memoria (sqlite://) usa un pool con una connessione per thread o condivisa
+    if issubclass(parsed.get_dialect().get_pool_class(parsed), QueuePool):
+        options.update(pool_size=config.db_pool_size, max_overflow=config.db_max_overflow, pool_timeout=config.db_pool_timeout)
+    return options
+
+
+def _create_engine(url: str, use_async: bool = False, savepoints: bool = False):
+    #Crea il motore di connessione al database secondo il profilo definito in app.config:
+    #niente echo delle query in produzione, pool di connessioni dimensionato esplicitamente e, per SQLite, i pragma di ogni connessione
+    new_engine = create_async_engine(url, **_engine_options(url)) if use_async else create_engine(url, **_engine_options(url))
+    if make_url(url).get_backend_name() == "sqlite": #gli eventi di connessione si registrano sempre sul motore sincrono sottostante
+        event.listen(new_engine.sync_engine if use_async else new_engine, "connect", _apply_sqlite_pragmas)
+        if savepoints: #il driver sqlite3 non gestisce da solo i SAVEPOINT: le transazioni vengono aperte esplicitamente
+            event.listen(new_engine, "connect", _disable_driver_transactions)
+            event.listen(new_engine, "begin", _begin_immediate)
+    if config.metrics_enabled:
+        instrument_engine(new_engine.sync_engine if use_async else new_engine)
+    return new_engine
+
+
+def _apply_sqlite_pragmas(dbapi_connection, _) -> None: #eseguita da SQLAlchemy ogni volta che apre una nuova connessione SQLite
+    cursor = dbapi_connection.cursor()
+    for name, value in config.sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def _disable_driver_transactions(dbapi_connection, _) -> None:
+    #il driver sqlite3 apre le transazioni solo prima di INSERT/UPDATE/DELETE e non tiene conto dei SAVEPOINT:
+    #le sue transazioni implicite vengono disattivate e il BEGIN viene inviato da _begin_immediate
+    dbapi_connection.isolation_level = None
+
+
+def _begin_immediate(connection) -> None: #eseguita da SQLAlchemy all'inizio di ogni transazione
+    connection.exec_driver_sql("BEGIN IMMEDIATE") #il lock di scrittura viene preso subito, invece che alla prima scrittura
+
+
+engine = _create_engine(database_url)
 #Una volta creato l’engine, potremo usarlo per: creare le tabelle, aprire sessioni, eseguire query (lettura, scrittura, modifica, cancellazione dati).
+#Il motore asincrono viene creato solo se richiesto, così il driver asincrono (ad esempio aiosqlite) serve solo in quel caso
+async_engine = _create_engine(config.async_database_url or _async_url(database_url), use_async=True) if config.db_async else None
+#Motore della coda di scrittura (app.data.writer), separato perché le sue transazioni isolano ogni richiesta in un SAVEPOINT
+write_engine = _create_engine(database_url, savepoints=True) if config.write_coalescing else None
+
+def insert_ignore(model):
+    """Returns an INSERT on model that skips rows conflicting with an existing key (INSERT ... ON CONFLICT DO NOTHING),
+    built for the dialect of the configured database"""
+    if dialect_name == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing()
+    return sa_insert(model).prefix_with("IGNORE") #MySQL/MariaDB: INSERT IGNORE
+
 
-def init_database() -> None: #Funzione che inizializza il database creando tutte le tabelle definite nei modelli SQLModel
-    ds_exists = os.path.isfile(sqlite_file_name) #controllo se il file del database esiste già
+def insert_or_add(model, key: list, column):
+    """Returns an INSERT on model that, for rows whose key already exists, adds the inserted value to column instead
+    (INSERT ... ON CONFLICT DO UPDATE SET column = column + excluded.column), built for the dialect of the configured database.
+    The increment happens in the database, so concurrent transactions never lose an update"""
+    if dialect_name in ("sqlite", "postgresql"):
+        statement = (sqlite if dialect_name == "sqlite" else postgresql).insert(model)
+        return statement.on_conflict_do_update(index_elements=key, set_={column.key: column + statement.excluded[column.key]})
+    statement = mysql.insert(model) #MySQL/MariaDB: ON DUPLICATE KEY UPDATE
+    return statement.on_duplicate_key_update({column.key: column + statement.inserted[column.key]})
+
+
+def init_database(with_fake_data: bool = True) -> None: #Funzione che inizializza il database creando tutte le tabelle definite nei modelli SQLModel
+    ds_exists = inspect(engine).has_table(Event.__tablename__) #controllo se il database è già stato creato (vale anche per database non SQLite)
+    counters_exist = inspect(engine).has_table(EventCounter.__tablename__)
     SQLModel.metadata.create_all(engine) #crea le tabelle nel database in base ai modelli definiti
-    if not ds_exists: #se il database è nuovo crea un oggetto Faker per generare dati causali e apre una session per popolarlo
-        f = Faker("it_IT") #generatore di dati finti in italiano
-        with Session(engine) as session: #Apre una sessione al database usando il contesto with, che si chiude automaticamente alla fine. Engine è il motore di connessione al DB. Session permette di eseguire operazioni sul database
-            # TODO: (optional) initialize the database with fake data
-            for i in range(10):  #ciclo che verrà eseguito 10 volte, per ogni iterazione viene creato un utente fittizio
-                user = User(username=f.username(), name=f.name(), email=f.email())
-                session.add(user) #aggiunge l'utente creato alla sessione del database
-            session.commit()  #salva tutte le modifiche fatte nella sessione
-            for i in range(10):  #ciclo che verrà eseguito 10 volte, per ogni iterazione viene creato un evento fittizio
-                event = Event(title=f.sentence(nb_words=5), description=f.sentence(nb_words=5), date=f.date_time(), location=f.sentence(nb_words=2))
-                session.add(event) #aggiunge l'evento creato alla sessione del database
-            session.commit()  #salva tutte le modifiche fatte nella sessione
-            for i in range(10):  #ciclo che verrà eseguito 10 volte, per ogni iterazione viene creata una registrazione fittizia
-                registration = Registration(username=f.username(), event_id=f.pyint(1, 10))
-                session.add(registration) #aggiunge la registrazione creata alla sessione del database
-            session.commit()  #salva tutte le modifiche fatte nella sessione
+    for table in SQLModel.metadata.sorted_tables: #create_all non aggiunge gli indici nuovi alle tabelle già esistenti
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    if "ix_registration_event_id" in {index["name"] for index in inspect(engine).get_indexes(Registration.__tablename__)}:
+        with engine.begin() as connection: #indice su event_id delle versioni precedenti, sostituito da ix_registration_event_id_username
+            connection.exec_driver_sql("DROP INDEX ix_registration_event_id" + (" ON registration" if dialect_name == "mysql" else ""))
+    if dialect_name == "sqlite": #indice full-text FTS5 per la ricerca degli eventi, mantenuto aggiornato da trigger
+        with engine.begin() as connection:
+            init_event_search(connection)
+    if ds_exists and not counters_exist: #database creato prima dei contatori: vengono calcolati dalle registrazioni esistenti
+        from app.data.counters import rebuild_counters #importata qui perché app.data.counters importa questo modulo
+        with engine.begin() as connection:
+            rebuild_counters(connection)
+    if not ds_exists and with_fake_data: #se il database è nuovo lo popola con pochi dati fittizi, coerenti tra loro
+        seed_database(engine, users=10, events=10, registrations=10)
 
 
 def get_session(): #Funzione che restituisce una nuova istanza di DB ogni volta che verrà chiamata e la terrà aperta per tutto il tempo necessario (grazie all'uso di yield)
@@ -45,3 +133,85 @@ def get_session(): #Funzione che restituisce una nuova istanza di DB ogni volta
 
 
 SessionDep = Annotated[Session, Depends(get_session)] #alias di tipo che incapsula sia il tipo (Session) sia la logica per crearlo (Depends(get_session)).
+
+
+async def run_inline(function, *args, **kwargs): #alternativa a run_in_threadpool, per chiamate che non attendono (vedi app.data.writer)
+    return function(*args, **kwargs)
+
+
+class ThreadedTransaction:
+    """Awaitable interface of AsyncSessionTransaction over the transaction of a sync Session (e.g. a SAVEPOINT)"""
+
+    def __init__(self, transaction, run=run_in_threadpool):
+        self.sync_transaction = transaction
+        self._run = run
+
+    @property
+    def is_active(self) -> bool:
+        return self.sync_transaction.is_active
+
+    async def commit(self) -> None:
+        await self._run(self.sync_transaction.commit)
+
+    async def rollback(self) -> None:
+        await self._run(self.sync_transaction.rollback)
+
+
+class ThreadedSession:
+    """Exposes a sync Session through the awaitable interface of AsyncSession.
+    Each blocking call runs in the threadpool, so async endpoints work unchanged when config.db_async is off.
+    run replaces run_in_threadpool, e.g. with run_inline"""
+
+    def __init__(self, session: Session, run=run_in_threadpool):
+        self.sync_session = session
+        self._run = run
+
+    async def exec(self, statement, **kwargs):
+        #come AsyncSession, le righe vengono lette tutte nel thread invece che durante l'iterazione nell'event loop
+        kwargs["execution_options"] = {**kwargs.get("execution_options", {}), "prebuffer_rows": True}
+        return await self._run(self.sync_session.exec, statement, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await self._run(self.sync_session.get, entity, ident, **kwargs)
+
+    def add(self, instance) -> None: #non accede al database, come in AsyncSession
+        self.sync_session.add(instance)
+
+    async def delete(self, instance) -> None:
+        await self._run(self.sync_session.delete, instance)
+
+    async def flush(self) -> None:
+        await self._run(self.sync_session.flush)
+
+    async def begin_nested(self) -> ThreadedTransaction: #SAVEPOINT, annullabile senza annullare il resto della transazione
+        return ThreadedTransaction(await self._run(self.sync_session.begin_nested), self._run)
+
+    async def commit(self) -> None:
+        await self._run(self.sync_session.commit)
+
+    async def rollback(self) -> None:
+        await self._run(self.sync_session.rollback)
+
+    async def close(self) -> None:
+        await self._run(self.sync_session.close)
+
+
+def new_async_session() -> AsyncSession | ThreadedSession:
+    """Opens a session with the awaitable interface, on the async engine or on the sync one according to config.db_async"""
+    if async_engine is not None:
+        return AsyncSession(async_engine, expire_on_commit=False)
+    return ThreadedSession(Session(engine, expire_on_commit=False))
+
+
+async def get_async_session(): #Come get_session, ma restituisce una sessione con interfaccia asincrona
+    session = new_async_session()
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)] #alias di tipo per gli endpoint async def
+#Come AsyncSessionDep, ma la sessione viene chiusa al termine della path function, prima dell'invio della risposta:
+#per gli endpoint che restituiscono uno stream, che altrimenti terrebbe occupata una connessione del pool fino alla fine
+StreamSessionDep = Annotated[AsyncSession, Depends(get_async_session, scope="function")]
@@ -0,0 +1,25 @@
+import json #usato quando orjson non è installato
+from datetime import datetime
+try:
+    import orjson #serializzatore JSON scritto in Rust, molto più veloce di json della libreria standard
+except ImportError:
+    orjson = None
+
+
+def _default(value): #tipi che json della libreria standard non sa serializzare
+    if isinstance(value, datetime): #stesso formato di Pydantic: ISO 8601 con "Z" per UTC
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    """Serializes value to compact UTF-8 JSON, with orjson when available, formatting datetimes like Pydantic"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_UTC_Z)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def dump_rows(names: list[str], rows) -> bytes:
+    """Serializes column tuples as a JSON array of objects with the given keys"""
+    return dumps([dict(zip(names, row)) for row in rows])
@@ -0,0 +1,138 @@
+import base64 #per rendere il cursore opaco (codifica base64 url-safe)
+import json #per serializzare i valori della chiave di ordinamento dentro il cursore
+from datetime import datetime #le date vengono serializzate in formato ISO e ricostruite alla decodifica
+from typing import Annotated #per annotare i tipi
+from fastapi import Depends, HTTPException, Query, Response #Query per i parametri della query string, Response per impostare l'header con il cursore successivo
+from fastapi.responses import StreamingResponse #le pagine grandi vengono inviate un pezzo alla volta
+from sqlalchemy import DateTime, and_, or_ #per costruire la condizione di keyset (a, b) > (x, y)
+from sqlalchemy import select as sa_select #select di SQLAlchemy, che restituisce sempre righe intere anche con una sola colonna
+from app.config import config
+from app.data.db import new_async_session #lo stream di una pagina grande apre una propria sessione, che resta aperta per tutta la durata dello stream
+from app.data.fastjson import dump_rows #serializzazione delle righe senza passare dai modelli Pydantic
+from app.metrics import chunked_queries #la query di ogni blocco è la stessa, non va segnalata come N+1
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor" #header della risposta che contiene il cursore della pagina successiva
+
+
+class PageParams: #Parametri di paginazione comuni a tutti gli endpoint che restituiscono liste
+    def __init__(
+            self,
+            limit: Annotated[int | None, Query(ge=1, description="Maximum number of items to return")] = None,
+            after: Annotated[str | None, Query(description="Opaque cursor returned in the X-Next-Cursor header of the previous page")] = None,
+    ):
+        self.limit = min(limit or config.default_page_size, config.max_page_size) #il limite non può superare la dimensione massima configurata
+        self.after = after
+
+
+PageDep = Annotated[PageParams, Depends()] #alias di tipo per iniettare i parametri di paginazione negli endpoint
+
+
+def encode_cursor(key: str, values: list) -> str:
+    """Encodes the sort key name and the values of the last returned row into an opaque cursor"""
+    payload = json.dumps({"k": key, "v": [v.isoformat() if isinstance(v, datetime) else v for v in values]})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=") #il padding viene rimosso per avere un cursore più compatto
+
+
+def decode_cursor(cursor: str, key: str, columns: list) -> list:
+    """Decodes a cursor produced by encode_cursor, checking that it was issued for the same sort key"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload["k"] != key or len(payload["v"]) != len(columns):
+            raise ValueError(cursor)
+        return [ #le date vengono ricostruite in base al tipo della colonna
+            datetime.fromisoformat(v) if isinstance(getattr(col.type, "impl", col.type), DateTime) else v
+            for col, v in zip(columns, payload["v"])
+        ]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor") #400->Bad Request
+
+
+def keyset_condition(columns: list, values: list, descending: bool):
+    #Costruisce la condizione (c1, c2, ...) > (v1, v2, ...) in forma espansa, supportata da tutti i database:
+    #c1 > v1 OR (c1 = v1 AND c2 > v2) OR ...
+    clauses = []
+    for i, column in enumerate(columns):
+        equals = [c == v for c, v in zip(columns[:i], values[:i])]
+        clauses.append(and_(*equals, column < values[i] if descending else column > values[i]))
+    return or_(*clauses)
+
+
+def _after_cursor(statement, columns: list, page: PageParams, descending: bool):
+    #Restituisce la chiave di ordinamento salvata nel cursore e statement limitato alle righe dopo il cursore di page
+    key = ",".join(column.key for column in columns) + (":desc" if descending else ":asc") #chiave di ordinamento e direzione, salvate nel cursore
+    if page.after:
+        statement = statement.where(keyset_condition(columns, decode_cursor(page.after, key, columns), descending))
+    return key, statement
+
+
+def _only_columns(statement, columns: list):
+    #Stessa FROM e WHERE di statement, ma selezionando solo columns. Non si usa with_only_columns perché
+    #la select di SQLModel su un solo modello resterebbe "scalare" e restituirebbe solo la prima colonna
+    return sa_select(*columns).select_from(*statement.get_final_froms()).where(statement.whereclause if statement.whereclause is not None else True)
+
+
+def _order(columns: list, descending: bool) -> list:
+    return [column.desc() if descending else column.asc() for column in columns]
+
+
+async def paginate(session, statement, columns: list, page: PageParams, response: Response, descending: bool = False, fields: list | None = None) -> list | Response:
+    """Runs statement ordered by columns, starting after the cursor in page, and returns at most page.limit rows.
+    When more rows are available the cursor of the next page is set in the X-Next-Cursor response header.
+    If fields are given and config.fast_json is on, the page is returned already serialized by paginate_json"""
+    if fields is not None and config.fast_json:
+        return await paginate_json(session, statement, columns, fields, page, descending)
+    key, statement = _after_cursor(statement, columns, page, descending)
+    statement = statement.order_by(*_order(columns, descending))
+    rows = (await session.exec(statement.limit(page.limit + 1))).all() #una riga in più per sapere se esiste la pagina successiva
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(key, [getattr(rows[-1], column.key) for column in columns])
+    return rows
+
+
+async def paginate_json(session, statement, columns: list, fields: list, page: PageParams, descending: bool = False) -> Response:
+    """Like paginate, but selects only the fields columns and returns the page already serialized to a JSON array of objects,
+    skipping the validation of the response model. fields must include the sort columns.
+    Pages longer than config.bulk_chunk_size are not built in memory: they are streamed, reading the rows in chunks with a session
+    of their own. session is then closed before returning, so the request does not hold a second pool connection during the stream"""
+    key, statement = _after_cursor(statement, columns, page, descending)
+    order = _order(columns, descending)
+    names = [field.key for field in fields]
+    rows_statement = _only_columns(statement, fields)
+    headers = {}
+    if page.limit <= config.bulk_chunk_size:
+        rows = (await session.exec(rows_statement.order_by(*order).limit(page.limit + 1))).all() #una riga in più per sapere se esiste la pagina successiva
+        if len(rows) > page.limit:
+            rows = rows[:page.limit]
+            headers[NEXT_CURSOR_HEADER] = encode_cursor(key, [rows[-1][names.index(column.key)] for column in columns])
+        return Response(dump_rows(names, rows), media_type="application/json", headers=headers)
+    #Pagina grande: si legge prima la chiave della sua ultima riga (e se ne esiste un'altra dopo), poi le righe fino a quella chiave
+    boundary = (await session.exec(rows_statement.with_only_columns(*columns).order_by(*order).offset(page.limit - 1).limit(2))).all()
+    if boundary:
+        last = list(boundary[0])
+        rows_statement = rows_statement.where(~keyset_condition(columns, last, descending)) #nessuna riga oltre l'ultima della pagina
+        if len(boundary) > 1:
+            headers[NEXT_CURSOR_HEADER] = encode_cursor(key, last)
+    await session.close() #restituisce subito la connessione al pool: lo stream usa la propria sessione
+    return StreamingResponse(_stream_rows(rows_statement, columns, names, order, descending), media_type="application/json", headers=headers)
+
+
+async def _stream_rows(statement, columns: list, names: list[str], order: list, descending: bool):
+    #Scrive le righe di statement (che seleziona le colonne names) come array JSON, leggendole a blocchi di config.bulk_chunk_size in ordine di keyset
+    positions = [names.index(column.key) for column in columns] #posizione delle colonne di ordinamento nelle righe
+    session = new_async_session()
+    try:
+        yield b"["
+        last, separator = None, b""
+        while True:
+            chunk = statement if last is None else statement.where(keyset_condition(columns, last, descending)) #riparte dalla chiave dell'ultima riga inviata
+            with chunked_queries():
+                rows = (await session.exec(chunk.order_by(*order).limit(config.bulk_chunk_size))).all()
+            if not rows:
+                break
+            yield separator + dump_rows(names, rows)[1:-1] #gli elementi del blocco, senza le parentesi quadre dell'array
+            separator = b","
+            last = [rows[-1][position] for position in positions]
+        yield b"]"
+    finally:
+        await session.close()
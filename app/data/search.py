@@ -0,0 +1,72 @@
+import html #i campi evidenziati vengono mostrati come HTML
+import re #per estrarre le parole dalla query di ricerca
+from sqlalchemy import Connection, Float, func, literal_column, select, table, column #costruzione delle query sulla tabella virtuale FTS5
+from app.models.event import Event
+
+#Tabella virtuale FTS5 con indice full-text su titolo, descrizione e luogo degli eventi.
+#È una tabella "external content": il testo resta nella tabella event, l'indice viene aggiornato dai trigger
+_EVENT_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS event_fts USING fts5(
+        title, description, location,
+        content='event', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_insert AFTER INSERT ON event BEGIN
+        INSERT INTO event_fts(rowid, title, description, location) VALUES (new.id, new.title, new.description, new.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_delete AFTER DELETE ON event BEGIN
+        INSERT INTO event_fts(event_fts, rowid, title, description, location) VALUES ('delete', old.id, old.title, old.description, old.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_update AFTER UPDATE ON event BEGIN
+        INSERT INTO event_fts(event_fts, rowid, title, description, location) VALUES ('delete', old.id, old.title, old.description, old.location);
+        INSERT INTO event_fts(rowid, title, description, location) VALUES (new.id, new.title, new.description, new.location);
+    END""",
+    #pesi di bm25 per colonna: una corrispondenza nel titolo conta più di una nel luogo, che conta più di una nella descrizione
+    "INSERT INTO event_fts(event_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0)')",
+]
+
+event_fts = table("event_fts", column("rowid"), column("event_fts"))
+rank = literal_column("event_fts.rank", Float) #punteggio bm25 (più basso = più rilevante), calcolato da FTS5
+
+HIGHLIGHT_START, HIGHLIGHT_END = "<mark>", "</mark>" #marcatori inseriti attorno alle parole trovate
+#FTS5 inserisce i marcatori nel testo non escapato: usa caratteri dell'area privata Unicode, sostituiti da highlight_html dopo l'escape
+_SENTINEL_START, _SENTINEL_END = "\ue000", "\ue001"
+
+
+def init_event_search(connection: Connection) -> None:
+    """Creates the FTS5 index on events and the triggers that keep it in sync, indexing the existing events when the index is new"""
+    is_new = not connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'event_fts'").first()
+    for statement in _EVENT_FTS_DDL:
+        connection.exec_driver_sql(statement)
+    if is_new:
+        connection.exec_driver_sql("INSERT INTO event_fts(event_fts) VALUES ('rebuild')")
+
+
+def match_query(text: str) -> str | None:
+    """Turns free text into an FTS5 query that matches all its words, the last one as a prefix.
+    Words are quoted, so FTS5 operators in the text are searched literally. Returns None if the text has no words"""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def highlight_html(text: str) -> str:
+    """Escapes a highlight()/snippet() result of search_statement as HTML and marks the matched words with HIGHLIGHT_START and HIGHLIGHT_END"""
+    return html.escape(text).replace(_SENTINEL_START, HIGHLIGHT_START).replace(_SENTINEL_END, HIGHLIGHT_END)
+
+
+def search_statement(query: str):
+    """Selects the events matching an FTS5 query with their rank and highlighted fields (to pass to highlight_html), ordered by relevance"""
+    return (
+        select(
+            Event,
+            rank.label("rank"),
+            func.highlight(literal_column("event_fts"), 0, _SENTINEL_START, _SENTINEL_END).label("title_highlight"),
+            func.snippet(literal_column("event_fts"), 1, _SENTINEL_START, _SENTINEL_END, "…", 24).label("description_snippet"),
+            func.highlight(literal_column("event_fts"), 2, _SENTINEL_START, _SENTINEL_END).label("location_highlight"),
+        )
+        .select_from(event_fts)
+        .join(Event, Event.id == event_fts.c.rowid)
+        .where(event_fts.c.event_fts.op("MATCH")(query))
+    )
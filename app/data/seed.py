@@ -0,0 +1,121 @@
+"""Fills the database with reproducible fake data.
+
+Users, events and registrations are generated with Faker from a fixed seed and
+written with multi-row INSERTs in batches; every registration refers to a
+generated user and event, whose registration counter is written too. On a database
+that already has data, new users and events are added next to the existing ones.
+Event ids are assigned by the database, so its id sequence (e.g. on PostgreSQL)
+stays in step with the generated rows.
+
+Run from the project root with:
+    python -m app.data.seed --users 100000 --events 10000 --registrations 1000000 --seed 42
+"""
+import argparse #per leggere i parametri da riga di comando
+import random
+import re #per leggere il suffisso numerico degli username esistenti
+import time
+from collections import Counter #registrazioni generate per evento, scritte nei contatori
+from datetime import datetime, timezone
+from faker import Faker #Libreria per generare dati fittizi con cui riempire in database
+from sqlalchemy import Engine, func, insert, select
+from app.models.event import Event, EventCounter
+from app.models.registration import Registration
+from app.models.user import User
+
+
+_FIRST_DATE, _LAST_DATE = datetime(2025, 1, 1, tzinfo=timezone.utc), datetime(2027, 1, 1, tzinfo=timezone.utc) #intervallo fisso, così le date non dipendono dal giorno in cui si esegue
+
+
+def _batches(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _next_username_suffix(connection) -> int:
+    #primo suffisso numerico maggiore di quelli degli username esistenti (ad esempio di un seed precedente):
+    #gli username generati finiscono tutti con ".<suffisso>", quindi non possono coincidere con quelli già presenti
+    suffixes = (re.search(r"\.(\d+)$", username) for username in connection.execute(select(User.username)).scalars())
+    return max((int(match.group(1)) + 1 for match in suffixes if match), default=0)
+
+
+def _insert_events(connection, batch: list[dict]) -> list[int]: #inserisce un batch di eventi e restituisce i loro id, nell'ordine delle righe
+    if connection.dialect.insert_executemany_returning_sort_by_parameter_order:
+        #gli id li assegna il database: con id espliciti la sequenza di PostgreSQL non avanzerebbe e il primo POST /events fallirebbe
+        return list(connection.execute(insert(Event).returning(Event.id, sort_by_parameter_order=True), batch).scalars())
+    #MySQL non supporta RETURNING: gli id vengono assegnati qui, e AUTO_INCREMENT riparte comunque dal più grande
+    first_id = (connection.execute(select(func.max(Event.id))).scalar() or 0) + 1
+    connection.execute(insert(Event), [{"id": first_id + i, **row} for i, row in enumerate(batch)])
+    return list(range(first_id, first_id + len(batch)))
+
+
+def seed_database(engine: Engine, users: int, events: int, registrations: int, seed: int = 0, batch_size: int = 5000, locale: str = "it_IT") -> dict[str, int]:
+    """Inserts the given number of fake users, events and registrations, generated from seed.
+    Each batch of batch_size rows is one INSERT statement in its own transaction. Returns the number of rows inserted per table"""
+    f = Faker(locale) #generatore di dati finti, in italiano di default
+    f.seed_instance(seed) #stesso seed -> stessi dati
+    rng = random.Random(seed)
+    registrations = min(registrations, users * events) #non possono esserci più registrazioni delle coppie distinte
+    with engine.begin() as connection:
+        first_suffix = _next_username_suffix(connection)
+    usernames = [f"{f.user_name()}.{first_suffix + i}" for i in range(users)] #il suffisso rende gli username univoci, anche rispetto a quelli esistenti
+    user_rows = ({"username": username, "name": f.name(), "email": f.email()} for username in usernames)
+    event_rows = (
+        {
+            "title": f.sentence(nb_words=5).rstrip("."),
+            "description": f.paragraph(nb_sentences=3),
+            "date": f.date_time_between(_FIRST_DATE, _LAST_DATE, tzinfo=timezone.utc),
+            "location": f.administrative_unit(), #provincia; f.city() non è riproducibile perché dipende dall'hash delle stringhe
+        }
+        for _ in range(events)
+    )
+
+    event_ids: list[int] = [] #id degli eventi generati, nell'ordine di generazione, man mano che vengono inseriti
+    counts = Counter()
+
+    def registration_rows(): #generate dopo l'inserimento degli eventi, quando i loro id sono noti
+        seen = set()
+        while len(seen) < registrations: #coppie (utente, evento) estratte a caso senza ripetizioni
+            pair = (rng.randrange(users), rng.randrange(events))
+            if pair not in seen:
+                seen.add(pair)
+                counts[event_ids[pair[1]]] += 1
+                yield {"username": usernames[pair[0]], "event_id": event_ids[pair[1]]}
+
+    def counter_rows(): #letti dopo le registrazioni; gli eventi sono nuovi, quindi i contatori si inseriscono senza aggiornare quelli esistenti
+        for id, count in counts.items():
+            yield {"event_id": id, "registrations": count}
+
+    for model, rows in ((User, user_rows), (Event, event_rows), (Registration, registration_rows()), (EventCounter, counter_rows())):
+        for batch in _batches(rows, batch_size):
+            with engine.begin() as connection: #una transazione per batch
+                if model is Event:
+                    event_ids.extend(_insert_events(connection, batch))
+                else:
+                    connection.execute(insert(model), batch)
+    return {"users": users, "events": events, "registrations": registrations}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=100)
+    parser.add_argument("--registrations", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--locale", default="it_IT")
+    args = parser.parse_args()
+    from app.data.db import engine, init_database #il database è quello configurato (DATABASE_URL o data/database.db)
+    init_database(with_fake_data=False)
+    start = time.perf_counter()
+    counts = seed_database(engine, args.users, args.events, args.registrations, args.seed, args.batch_size, args.locale)
+    print(", ".join(f"{count} {name}" for name, count in counts.items()), f"inserted in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import asyncio #il task di scrittura e le richieste si passano il turno tramite future dell'event loop
+import contextvars
+from collections import deque
+from typing import Annotated
+from fastapi import Depends
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app.config import config
+from app.data.db import ThreadedSession, dialect_name, new_async_session, run_inline, write_engine
+
+
+class _Turn: #Turno di scrittura di una richiesta all'interno di un gruppo
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.granted: asyncio.Future = loop.create_future() #la sessione del gruppo, quando tocca a questa richiesta
+        self.done: asyncio.Future = loop.create_future() #False se il SAVEPOINT della richiesta non è stato chiuso correttamente
+        self.committed: asyncio.Future = loop.create_future() #esito del commit del gruppo
+
+
+def _group_session() -> ThreadedSession:
+    #Sessione sincrona anche con config.db_async: le scritture avvengono comunque una alla volta su una sola connessione.
+    #Su SQLite il gruppo prende il lock di scrittura all'inizio (BEGIN IMMEDIATE), quindi le istruzioni delle richieste non attendono
+    #altre connessioni e vengono eseguite direttamente nell'event loop, senza un passaggio nel threadpool per ognuna
+    run = run_inline if dialect_name == "sqlite" else run_in_threadpool
+    return ThreadedSession(Session(write_engine, expire_on_commit=False), run)
+
+
+class WriteQueue:
+    """Runs the writes of many requests on a single connection and commits them in groups.
+    A writer task opens one transaction per group and gives each queued request its turn, one at a time: the request runs
+    its statements in a SAVEPOINT, which is released on commit or rolled back on error, so a failed request does not
+    affect the others. The group is committed when the queue is empty and config.write_batch_window_ms milliseconds have
+    passed since its first turn, or after config.write_batch_max turns; only then do the commits of its requests return"""
+
+    def __init__(self):
+        self._pending: deque[_Turn] = deque()
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def submit(self) -> _Turn:
+        """Queues a turn for the calling request, starting the writer task if it is not running"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop: #ad esempio dopo asyncio.run nei test
+            self._pending, self._wakeup = deque(), asyncio.Event()
+            #contesto vuoto: il task non deve ereditare quello della richiesta che lo avvia (ad esempio le statistiche SQL di app.metrics)
+            self._task = loop.create_task(self._run(), context=contextvars.Context())
+        turn = _Turn(loop)
+        self._pending.append(turn)
+        self._wakeup.set()
+        return turn
+
+    async def stop(self) -> None:
+        """Stops the writer task. Queued requests fail, the group in progress is rolled back"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            self._pending.popleft().granted.cancel()
+
+    async def _next(self, timeout: float | None) -> _Turn | None: #il prossimo turno in coda, oppure None se non arriva entro timeout secondi
+        if not self._pending:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                return None
+        return self._pending.popleft()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            turn = await self._next(None)
+            session = _group_session()
+            served: list[_Turn] = []
+            try:
+                await run_in_threadpool(session.sync_session.connection) #apre la transazione: l'attesa del lock avviene nel threadpool
+                deadline = loop.time() + config.write_batch_window_ms / 1000
+                while turn is not None:
+                    if not turn.granted.cancelled(): #la richiesta potrebbe essere stata annullata mentre era in coda
+                        turn.granted.set_result(session)
+                        served.append(turn)
+                        if not await turn.done:
+                            raise RuntimeError("a write did not release its savepoint")
+                    if len(served) >= config.write_batch_max:
+                        break
+                    turn = await self._next(max(deadline - loop.time(), 0))
+                await run_in_threadpool(session.sync_session.commit) #un solo commit (e un solo fsync) per tutte le scritture del gruppo
+            except BaseException as error:
+                if turn is not None and not turn.granted.done(): #ad esempio il lock non è stato ottenuto entro il busy_timeout
+                    turn.granted.set_exception(error if isinstance(error, Exception) else RuntimeError("the write queue stopped"))
+                for served_turn in served:
+                    served_turn.committed.set_exception(error if isinstance(error, Exception) else RuntimeError("the write queue stopped"))
+                    served_turn.committed.exception() #l'errore viene comunque letto, anche se la richiesta non attende più il commit
+                if not isinstance(error, Exception):
+                    raise
+            else:
+                for served_turn in served:
+                    served_turn.committed.set_result(None)
+            finally:
+                await run_in_threadpool(session.sync_session.close) #annulla la transazione se il commit non è avvenuto
+
+
+class QueuedSession:
+    """Session with the interface of AsyncSession whose statements run in the turn of the request in the write queue.
+    The turn starts with the first statement; commit() releases the SAVEPOINT of the request and waits for the commit
+    of its group; rollback() rolls back the SAVEPOINT only. Closing the session without committing rolls it back"""
+
+    def __init__(self, queue: WriteQueue):
+        self._queue = queue
+        self._turn: _Turn | None = None
+        self._savepoint = None
+        self._added: list = [] #oggetti aggiunti prima dell'inizio del turno
+
+    async def _session(self):
+        if self._turn is None:
+            self._turn = self._queue.submit()
+            await self._turn.granted
+            self._savepoint = await self._turn.granted.result().begin_nested()
+        session = self._turn.granted.result()
+        while self._added:
+            session.add(self._added.pop(0))
+        return session
+
+    async def _end(self, release: bool) -> None: #chiude il SAVEPOINT e restituisce il turno al task di scrittura
+        turn, savepoint = self._turn, self._savepoint
+        self._turn = self._savepoint = None
+        clean = False
+        try:
+            if savepoint is not None:
+                try:
+                    if release and savepoint.is_active:
+                        await savepoint.commit()
+                        savepoint = None
+                finally:
+                    #anche se non è più attivo (ad esempio dopo un errore di vincolo nel flush): finché non viene annullato
+                    #la sessione del gruppo rifiuta ogni altra istruzione, comprese quelle delle richieste successive
+                    if savepoint is not None:
+                        await savepoint.rollback()
+            clean = True
+        finally:
+            turn.done.set_result(clean)
+
+    async def exec(self, statement, **kwargs):
+        return await (await self._session()).exec(statement, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await (await self._session()).get(entity, ident, **kwargs)
+
+    def add(self, instance) -> None:
+        if self._turn is not None and self._turn.granted.done():
+            self._turn.granted.result().add(instance)
+        else:
+            self._added.append(instance)
+
+    async def delete(self, instance) -> None:
+        await (await self._session()).delete(instance)
+
+    async def flush(self) -> None:
+        await (await self._session()).flush()
+
+    async def commit(self) -> None:
+        await (await self._session()).flush() #un errore di vincolo emerge qui, quando il SAVEPOINT può ancora essere annullato
+        turn = self._turn
+        await self._end(release=True)
+        await turn.committed #la modifica è confermata solo dopo il commit del gruppo
+
+    async def rollback(self) -> None:
+        self._added.clear()
+        if self._savepoint is not None: #il turno continua, con un nuovo SAVEPOINT
+            await self._savepoint.rollback()
+            self._savepoint = await self._turn.granted.result().begin_nested()
+
+    async def close(self) -> None:
+        self._added.clear()
+        if self._turn is not None and not self._turn.granted.cancel(): #in coda: il turno viene annullato, altrimenti restituito
+            await self._end(release=False)
+        self._turn = None
+
+
+write_queue: WriteQueue = WriteQueue() #scritture degli endpoint di events, users e registrations, quando config.write_coalescing è attivo
+
+
+async def get_write_session(): #Come get_async_session, ma con config.write_coalescing le scritture passano dalla coda
+    session = QueuedSession(write_queue) if config.write_coalescing else new_async_session()
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+#scope="function": la sessione viene chiusa (e il turno restituito) prima dell'invio della risposta
+WriteSessionDep = Annotated[AsyncSession, Depends(get_write_session, scope="function")]
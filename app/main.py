@@ -8,10 +8,12 @@ if Path(__file__).parent == Path(os.getcwd()):
 #statiche/database nel caso in cui qualcuno faccia partire l’app in modo “non standard”
 
 from fastapi import FastAPI
-from app.routers import frontend, events, users, registrations
+from app.routers import frontend, events, users, registrations, metrics
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from app.data.db import init_database
+from app.data.writer import write_queue
+from app.metrics import MetricsMiddleware
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
@@ -19,6 +21,7 @@ async def lifespan(_: FastAPI):
     init_database() # apre la connessione al database, crea eventuali tabelle mancanti e applica migrazioni
     yield  #FastAPI resta in ascolto delle richieste.
     # on close
+    await write_queue.stop() #il task della coda di scrittura, avviato dalla prima scrittura se config.write_coalescing è attivo
 
 app = FastAPI(lifespan=lifespan)
 app.mount(
@@ -26,12 +29,16 @@ app.mount(
     StaticFiles(directory=config.root_dir / "static"),
     name="static"
 )
+if config.metrics_enabled:
+    app.add_middleware(MetricsMiddleware) #latenza e query SQL di ogni richiesta, esposte su /metrics
 
 #Registriamo le API definite nei vari moduli
 app.include_router(frontend.router)
 app.include_router(events.router)
 app.include_router(users.router)
 app.include_router(registrations.router)
+if config.metrics_enabled:
+    app.include_router(metrics.router)
 
 if __name__ == "__main__":
     import uvicorn
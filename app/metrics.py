@@ -0,0 +1,190 @@
+import logging
+import threading #le query SQL possono essere registrate dai thread del threadpool
+import time
+from bisect import bisect_left #per trovare il bucket dell'istogramma in tempo logaritmico
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar #statistiche della richiesta in corso, visibili anche nei thread e nei greenlet che la servono
+from sqlalchemy import Engine, event
+from app.config import config
+
+logger = logging.getLogger("app.metrics")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) #secondi
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500) #query per richiesta
+
+
+class _Histogram: #Istogramma cumulativo in stile Prometheus
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) #l'ultimo bucket è +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class HistogramFamily:
+    """Histograms with the same name, one per combination of label values"""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._children: dict[tuple, _Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            child = self._children.get(label_values)
+            if child is None:
+                child = self._children[label_values] = _Histogram(self.buckets)
+            child.observe(value)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, child in sorted(self._children.items()):
+                labels = _labels(self.labels, label_values)
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), child.counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{{{labels}{',' if labels else ''}le=\"{bound}\"}} {cumulative}")
+                lines.append(f"{self.name}_sum{_braces(labels)} {child.sum}")
+                lines.append(f"{self.name}_count{_braces(labels)} {child.count}")
+        return lines
+
+
+class CounterFamily:
+    """Counters with the same name, one per combination of label values"""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._children: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str) -> None:
+        with self._lock:
+            self._children[label_values] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._children.items()):
+                lines.append(f"{self.name}{_braces(_labels(self.labels, label_values))} {value}")
+        return lines
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    return ",".join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in zip(names, values))
+
+
+def _braces(labels: str) -> str: #le metriche senza etichette si scrivono senza graffe
+    return f"{{{labels}}}" if labels else ""
+
+
+request_duration = HistogramFamily("http_request_duration_seconds", "Latency of HTTP requests", ("method", "route", "status"))
+request_queries = HistogramFamily("db_queries_per_request", "SQL queries executed by each HTTP request", ("route",), COUNT_BUCKETS)
+request_sql_time = HistogramFamily("db_time_per_request_seconds", "Time spent in SQL by each HTTP request", ("route",))
+query_duration = HistogramFamily("db_query_duration_seconds", "Latency of SQL queries")
+slow_queries = CounterFamily("db_slow_queries_total", "SQL queries slower than the configured threshold", ("route",))
+n_plus_one = CounterFamily("db_n_plus_one_total", "HTTP requests that ran the same SQL statement many times", ("route",))
+FAMILIES = (request_duration, request_queries, request_sql_time, query_duration, slow_queries, n_plus_one)
+
+
+def render_metrics() -> str:
+    """Returns all metrics in the Prometheus text exposition format"""
+    return "\n".join(line for family in FAMILIES for line in family.render()) + "\n"
+
+
+class RequestStats: #statistiche SQL della richiesta in corso
+    __slots__ = ("queries", "sql_time", "statements", "_scope")
+
+    def __init__(self, scope: dict):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements: Counter = Counter() #testo SQL -> esecuzioni, per riconoscere i pattern N+1
+        self._scope = scope
+
+    @property
+    def route(self) -> str: #il template della rotta (es. /events/{id}), non l'URL, per limitare il numero di serie
+        return getattr(self._scope.get("route"), "path", "unmatched") #la rotta viene scritta nello scope dal router di Starlette
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+_chunked: ContextVar[bool] = ContextVar("chunked_queries", default=False)
+
+
+@contextmanager
+def chunked_queries():
+    """Marks the SQL queries run in the block as repeated once per chunk by design (e.g. the keyset chunks of an export),
+    so running them many times in one request is not reported as a possible N+1"""
+    token = _chunked.set(True)
+    try:
+        yield
+    finally:
+        _chunked.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - context._metrics_start
+    query_duration.observe(elapsed)
+    stats = _current.get()
+    if stats is not None: #query eseguita durante una richiesta HTTP
+        stats.queries += 1
+        stats.sql_time += elapsed
+        if not _chunked.get(): #le query ripetute a ogni blocco non sono un N+1
+            stats.statements[statement] += 1
+    if elapsed * 1000 >= config.slow_query_ms:
+        route = stats.route if stats is not None else "none"
+        slow_queries.inc(route)
+        logger.warning("Slow SQL query (%.1f ms) in %s: %s", elapsed * 1000, route, statement)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Times every SQL query run by engine and attributes it to the HTTP request in progress, if any"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency and the SQL activity of every HTTP request.
+    With config.server_timing it also adds a Server-Timing header with the SQL time and query count"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500 #se l'applicazione solleva un'eccezione prima di rispondere
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if config.server_timing:
+                    timing = f'db;dur={stats.sql_time * 1000:.2f};desc="{stats.queries} queries", app;dur={(time.perf_counter() - start) * 1000:.2f}'
+                    message.setdefault("headers", []).append((b"server-timing", timing.encode()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _current.reset(token)
+            route = stats.route
+            request_duration.observe(time.perf_counter() - start, scope["method"], route, str(status))
+            request_queries.observe(stats.queries, route)
+            request_sql_time.observe(stats.sql_time, route)
+            if stats.statements and max(stats.statements.values()) >= config.n_plus_one_threshold:
+                statement, count = stats.statements.most_common(1)[0]
+                n_plus_one.inc(route)
+                logger.warning("Possible N+1 query pattern in %s %s: statement executed %d times: %s", scope["method"], route, count, statement)
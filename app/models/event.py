@@ -5,8 +5,8 @@ from sqlmodel import SQLModel, Field #la classe SQLModel per i modelli ORM/Pydan
 class EventBase(SQLModel): #superclasse da cui derivano gli altri modelli, utile per utilizzare gli attributi comuni
     title: str = Field()
     description: str = Field()
-    date: datetime = Field()
-    location: str = Field()
+    date: datetime = Field(index=True) #indicizzato per i filtri e l'ordinamento per data
+    location: str = Field(index=True) #indicizzato per il filtro per luogo
 
     @field_validator("date", mode="before") #metodo che viene eseguito prima della validazione del campo date
     def parse_date(cls, value):
@@ -24,4 +24,23 @@ class EventCreate(EventBase): #Schema per creare un nuovo evento tramite API. No
     pass
 
 class EventPublic(Event): #Schema per restituire le info di un evento. Include id.
-    pass
+    registrations: int | None = None #numero di registrazioni, presente solo se richiesto con include_counts
+
+class DateBucketStats(SQLModel): #Numero di eventi e di registrazioni in un intervallo di date (giorno, settimana, mese o anno)
+    bucket: str
+    events: int
+    registrations: int
+
+class EventStats(SQLModel): #Schema restituito da GET /events/stats
+    top: list[EventPublic] #eventi con più registrazioni
+    buckets: list[DateBucketStats]
+
+class EventCounter(SQLModel, table=True): #Contatore delle registrazioni di un evento, aggiornato nella stessa transazione di ogni registrazione
+    event_id: int = Field(primary_key=True, foreign_key="event.id")
+    registrations: int = Field(default=0, index=True) #indicizzato per trovare gli eventi con più registrazioni senza contarle
+
+class EventSearchResult(EventBase): #Schema di un risultato della ricerca full-text: l'evento più i campi con le parole trovate evidenziate
+    id: int
+    title_highlight: str
+    description_snippet: str #porzione della descrizione attorno alle parole trovate
+    location_highlight: str
@@ -1,7 +1,10 @@
-from sqlmodel import SQLModel, Field #la classe SQLModel per i modelli ORM/Pydantic, Field per applicare dei vincoli sui dati
+from sqlmodel import SQLModel, Field, Index #la classe SQLModel per i modelli ORM/Pydantic, Field per applicare dei vincoli sui dati, Index per gli indici su più colonne
 
 
 
 class Registration(SQLModel, table=True): #modello relazionale, genera una tabella nel database che mette in relazione Event e User
     username: str = Field(primary_key=True, foreign_key="user.username") #Definisce un campo username che è una chiave esterna
     event_id: int = Field(primary_key=True, foreign_key="event.id") #Definisce un campo event_id che è una chiave esterna
+    #l'indice secondario (event_id, username) serve le ricerche per evento, che la chiave primaria (username, event_id) non può servire,
+    #già ordinate per username: le pagine di un evento sono una scansione di un intervallo dell'indice, senza ordinare le sue registrazioni
+    __table_args__ = (Index("ix_registration_event_id_username", "event_id", "username"),)
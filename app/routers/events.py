@@ -1,50 +1,246 @@
-from fastapi import APIRouter, Path, HTTPException #Usiamo la classe APIRouter al posto di FastAPI quando costruiamo parti modulari dell'app. Path serve per specificare i parametri nell'URL. HTTPException per gestire le eccezioni.
-from sqlmodel import select, delete #select e delete sono funzioni di costruzione/eliminazione delle query di SQLModel
-from app.data.db import SessionDep #SessionDep è un alias di tipo per l’iniezione di dipendenza di FastAPI. Per aprire e chiudere automaticamente una Session (connetterci al DB)
-from app.models.event import Event, EventCreate, EventPublic
-from typing import Annotated #per annotare i tipi
+from fastapi import APIRouter, Path, HTTPException, Query, Request, Response #Usiamo la classe APIRouter al posto di FastAPI quando costruiamo parti modulari dell'app. Path serve per specificare i parametri nell'URL. HTTPException per gestire le eccezioni.
+from sqlmodel import select, delete, insert #select, delete e insert sono funzioni di costruzione delle query di SQLModel
+from sqlalchemy import func, literal, select as sa_select #per l'INSERT ... SELECT della registrazione e le statistiche
+from app.data.db import AsyncSessionDep, StreamSessionDep, insert_ignore, dialect_name #AsyncSessionDep è un alias di tipo per l’iniezione di dipendenza di FastAPI. Per aprire e chiudere automaticamente una sessione asincrona (connetterci al DB)
+from app.data.writer import WriteSessionDep #sessione delle scritture singole, che con WRITE_COALESCING passano dalla coda di scrittura
+from app.models.event import Event, EventCounter, EventCreate, EventPublic, EventSearchResult, EventStats, DateBucketStats
+from typing import Annotated, Literal #per annotare i tipi
+from app.config import config
+from datetime import datetime, timezone #per i filtri sull'intervallo di date
+from app.data.pagination import PageDep, paginate, keyset_condition, encode_cursor, decode_cursor, NEXT_CURSOR_HEADER #paginazione keyset con cursore opaco
+from app.data.search import match_query, search_statement, highlight_html, rank #ricerca full-text con l'indice FTS5
+from app.data.bulk import validated_chunks, ndjson_export #inserimento a blocchi ed export NDJSON
+from app.metrics import chunked_queries #i blocchi ripetono le stesse query per costruzione
+from app.data.cache import event_cache #cache delle letture degli eventi, invalidata dagli endpoint che li modificano
+from app.data.broker import event_broker, Subscription, RESYNC, REGISTRATIONS_ADDED, EVENT_UPDATED, EVENT_DELETED #notifiche delle modifiche ai client collegati allo stream
+from app.data.fastjson import dumps #serializzazione dei messaggi dello stream
+from app.data.counters import add_registrations, invalidate_counts, registrations_count, date_bucket, counts_item_scope, COUNTS_LIST_SCOPE, STATS_SCOPE #contatori delle registrazioni per evento
+from fastapi.responses import StreamingResponse #per inviare lo stream degli aggiornamenti
+import asyncio #per l'attesa con timeout dei messaggi dello stream
 from app.models.registration import Registration #import necessario per usare la classe Registration definita nel package models nel file python registration.py
 from app.models.user import User #import necessario per usare la classe User definita nel package models nel file python user.py
 
+EVENT_FIELDS = [getattr(Event, name) for name in Event.model_fields] #colonne lette dalle liste serializzate senza i modelli, nell'ordine dei campi di Event
 router = APIRouter(prefix="/events", tags=["events"]) #Inizializzazione del router.Tutti gli endpoint definiti saranno sotto il path /events. Il tag "events" sarà utilizzato nella documentazione Swagger
 
 @router.get("/") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /events
-def get_all_events(session: SessionDep)->list[EventPublic]: #endpoint/path function, restituisce una lista di oggetti EventPublic
-    """Returns the list of available events""" #questa descrizione appare nella documentazione /docs
-    events = session.exec(select(Event)).all() #eseguiamo una query che seleziona tutti gli eventi
-    return events
+async def get_all_events( #endpoint/path function, restituisce una pagina di oggetti EventPublic
+        session: AsyncSessionDep,
+        page: PageDep,
+        request: Request,
+        date_from: Annotated[datetime | None, Query(description="Only events on or after this date")] = None,
+        date_to: Annotated[datetime | None, Query(description="Only events on or before this date")] = None,
+        location: Annotated[str | None, Query(description="Only events in this location")] = None,
+        sort: Annotated[Literal["id", "date"], Query(description="Sort key")] = "id",
+        order: Annotated[Literal["asc", "desc"], Query(description="Sort direction")] = "asc",
+        include_counts: Annotated[bool, Query(description="Include the number of registrations of each event")] = False,
+)->list[EventPublic]:
+    """Returns a page of available events, optionally filtered by date range and location, and with their number of registrations.
+    The cursor of the next page, if any, is returned in the X-Next-Cursor header.
+    Responses are cached and carry ETag and Last-Modified headers for conditional requests""" #questa descrizione appare nella documentazione /docs
+    statement = select(Event) #query che seleziona gli eventi, a cui aggiungiamo i filtri richiesti
+    #come in EventBase.parse_date, una data senza fuso orario viene interpretata in UTC
+    if date_from:
+        statement = statement.where(Event.date >= (date_from if date_from.tzinfo else date_from.replace(tzinfo=timezone.utc)))
+    if date_to:
+        statement = statement.where(Event.date <= (date_to if date_to.tzinfo else date_to.replace(tzinfo=timezone.utc)))
+    if location:
+        statement = statement.where(Event.location == location)
+    columns = [Event.date, Event.id] if sort == "date" else [Event.id] #l'id rende l'ordinamento per data univoco e quindi stabile
 
+    async def build(response: Response): #eseguita solo se la pagina non è in cache
+        if not include_counts:
+            return await paginate(session, statement, columns, page, response, descending=order == "desc", fields=EVENT_FIELDS)
+        counted = statement.outerjoin(EventCounter, EventCounter.event_id == Event.id) #i conteggi vengono letti dai contatori, senza contare le registrazioni
+        events = await paginate(session, counted, columns, page, response, descending=order == "desc", fields=[*EVENT_FIELDS, registrations_count])
+        return events if isinstance(events, Response) else await _with_counts(session, events)
+    #le risposte con i conteggi hanno uno scope separato, invalidato ad ogni registrazione
+    return await event_cache.respond(request, COUNTS_LIST_SCOPE if include_counts else "events:list", build)
+
+
+async def _with_counts(session, events: list[Event]) -> list[EventPublic]: #aggiunge agli eventi il numero di registrazioni, con una sola query sui contatori
+    counters = (await session.exec(select(EventCounter).where(EventCounter.event_id.in_([event.id for event in events])))).all()
+    counts = {counter.event_id: counter.registrations for counter in counters}
+    return [EventPublic(**event.model_dump(), registrations=counts.get(event.id, 0)) for event in events]
+
+
+@router.get("/stats") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /events/stats (prima di /{id})
+async def get_event_stats( #endpoint/path function, restituisce un oggetto EventStats
+        session: AsyncSessionDep,
+        request: Request,
+        top: Annotated[int, Query(ge=1, le=100, description="Number of events with most registrations to return")] = 10,
+        bucket: Annotated[Literal["day", "week", "month", "year"], Query(description="Size of the date buckets")] = "month",
+)->EventStats:
+    """Returns the events with most registrations and, for each date bucket, the number of events and of their registrations.
+    Counts are read from the registration counters, so the cost does not grow with the number of registrations""" #questa descrizione appare nella documentazione /docs
+    async def build(_: Response): #eseguita solo se le statistiche non sono in cache
+        top_rows = (await session.exec(
+            sa_select(*EVENT_FIELDS, EventCounter.registrations)
+            .join(EventCounter, EventCounter.event_id == Event.id)
+            .where(EventCounter.registrations > 0)
+            .order_by(EventCounter.registrations.desc(), Event.id) #scansione all'indietro dell'indice sui contatori
+            .limit(top)
+        )).all()
+        date = date_bucket(Event.date, bucket).label("bucket")
+        bucket_rows = (await session.exec(
+            sa_select(date, func.count(Event.id), func.coalesce(func.sum(EventCounter.registrations), 0))
+            .outerjoin(EventCounter, EventCounter.event_id == Event.id)
+            .group_by(date)
+            .order_by(date)
+        )).all()
+        return EventStats(
+            top=[EventPublic(**row._mapping) for row in top_rows],
+            buckets=[DateBucketStats(bucket=name, events=events, registrations=registrations) for name, events, registrations in bucket_rows],
+        )
+    return await event_cache.respond(request, STATS_SCOPE, build)
+
+
+
+@router.get("/export") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /events/export (prima di /{id}, altrimenti "export" verrebbe letto come id)
+async def export_events(): #endpoint/path function, restituisce uno stream NDJSON
+    """Streams all events as NDJSON, one event per line""" #questa descrizione appare nella documentazione /docs
+    return ndjson_export(Event, [Event.id])
+
+
+@router.get("/search") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /events/search (prima di /{id})
+async def search_events( #endpoint/path function, restituisce una pagina di risultati ordinati per rilevanza
+        session: AsyncSessionDep,
+        q: Annotated[str, Query(min_length=1, description="Words to search in title, description and location")],
+        page: PageDep,
+        response: Response,
+)->list[EventSearchResult]:
+    """Full-text search over title, description and location of the events.
+    Results are ordered by relevance (bm25) and the matched words are wrapped in <mark> tags.
+    The cursor of the next page, if any, is returned in the X-Next-Cursor header""" #questa descrizione appare nella documentazione /docs
+    if dialect_name != "sqlite":
+        raise HTTPException(status_code=501, detail="Full-text search requires the SQLite FTS5 index") #501 -> Not Implemented
+    query = match_query(q)
+    if query is None: #nessuna parola da cercare
+        return []
+    statement = search_statement(query)
+    columns = [rank, Event.id] #la rilevanza e poi l'id per rendere l'ordinamento univoco
+    if page.after:
+        statement = statement.where(keyset_condition(columns, decode_cursor(page.after, "rank,id:asc", columns), descending=False))
+    rows = (await session.exec(statement.order_by(*columns).limit(page.limit + 1))).all() #una riga in più per sapere se esiste la pagina successiva
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor("rank,id:asc", [rows[-1].rank, rows[-1].Event.id])
+    return [
+        EventSearchResult(
+            **row.Event.model_dump(),
+            title_highlight=highlight_html(row.title_highlight), #testo escapato, in cui solo i tag <mark> sono HTML
+            description_snippet=highlight_html(row.description_snippet),
+            location_highlight=highlight_html(row.location_highlight),
+        )
+        for row in rows
+    ]
 
 
 @router.get("/{id}") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /events/{id}
-def get_event( #endpoint/path function, restituisce un oggetto EventPublic
-        session: SessionDep,
-        id: Annotated[int, Path(description="The id of the event to get")]
+async def get_event( #endpoint/path function, restituisce un oggetto EventPublic
+        session: AsyncSessionDep,
+        id: Annotated[int, Path(description="The id of the event to get")],
+        request: Request,
+        include_counts: Annotated[bool, Query(description="Include the number of registrations of the event")] = False,
 )->EventPublic:
-    """Returns the event with the given ID""" #questa descrizione appare nella documentazione /docs
-    event = session.get(Event, id) #Cerca l'evento con l'ID dato
-    if not event: #se l'evento non è esiste, viene sollevata un'eccezione
-        raise HTTPException(status_code=404, detail=f"The event with ID {id} was not found") #404->la risorsa richiesta (l'evento con l'ID cercato) non esiste
-    return event
+    """Returns the event with the given ID, optionally with its number of registrations.
+    Responses are cached and carry ETag and Last-Modified headers for conditional requests""" #questa descrizione appare nella documentazione /docs
+    async def build(_: Response): #eseguita solo se l'evento non è in cache
+        event = await session.get(Event, id) #Cerca l'evento con l'ID dato
+        if not event: #se l'evento non è esiste, viene sollevata un'eccezione (e la risposta non viene messa in cache)
+            raise HTTPException(status_code=404, detail=f"The event with ID {id} was not found") #404->la risorsa richiesta (l'evento con l'ID cercato) non esiste
+        if include_counts:
+            counter = await session.get(EventCounter, id) #lettura per chiave primaria, qualunque sia il numero di registrazioni
+            return EventPublic(**event.model_dump(), registrations=counter.registrations if counter else 0)
+        return event
+    return await event_cache.respond(request, counts_item_scope(id) if include_counts else f"events:item:{id}", build)
+
+
+@router.get("/{id}/registrations") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /events/{id}/registrations
+async def get_event_registrations( #endpoint/path function, restituisce una pagina di oggetti Registration
+        session: AsyncSessionDep,
+        id: Annotated[int, Path(description="The id of the event whose registrations to get")],
+        page: PageDep,
+        response: Response,
+)->list[Registration]:
+    """Returns a page of registrations for the event with the given ID, ordered by username""" #questa descrizione appare nella documentazione /docs
+    if not await session.get(Event, id): #se l'evento non esiste, viene sollevata un'eccezione
+        raise HTTPException(status_code=404, detail=f"The event with ID {id} was not found") #404->la risorsa richiesta non esiste
+    statement = select(Registration).where(Registration.event_id == id) #scansione per intervallo sull'indice di event_id
+    return await paginate(session, statement, [Registration.username], page, response, fields=[Registration.username, Registration.event_id])
+
+
+@router.get("/{id}/stream") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /events/{id}/stream
+async def stream_event_changes( #endpoint/path function, restituisce uno stream text/event-stream
+        session: StreamSessionDep,
+        id: Annotated[int, Path(description="The id of the event whose changes to stream")],
+):
+    """Streams the changes of the event with the given ID as Server-Sent Events.
+    Messages: registrations_added and registrations_removed ({"event_id", "usernames"}), event_updated (the event),
+    event_deleted (then the stream ends) and resync, sent on connection and whenever the client fell behind and messages were dropped:
+    the client should then reload the event and its registrations""" #questa descrizione appare nella documentazione /docs
+    if not await session.get(Event, id): #se l'evento non esiste, viene sollevata un'eccezione
+        raise HTTPException(status_code=404, detail=f"The event with ID {id} was not found") #404->la risorsa richiesta non esiste
+    return StreamingResponse(
+        _event_stream(id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, #niente cache e niente buffering nei proxy
+    )
+
+
+async def _event_stream(id: int):
+    subscription: Subscription = event_broker.subscribe(id) #la sottoscrizione precede il resync iniziale, così nessuna modifica va persa
+    try:
+        message = (RESYNC, {})
+        while True:
+            if message is None: #nessun messaggio per config.sse_heartbeat secondi
+                yield b": keep-alive\n\n" #commento SSE: mantiene aperta la connessione e rileva i client disconnessi
+            else:
+                name, data = message
+                yield b"event: " + name.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+                if name == EVENT_DELETED:
+                    return
+            try:
+                message = await asyncio.wait_for(subscription.get(), config.sse_heartbeat)
+            except asyncio.TimeoutError:
+                message = None
+    finally:
+        event_broker.unsubscribe(subscription)
 
 
 @router.post("/") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint POST /events
-def add_event(session: SessionDep, event: EventCreate): #Endpoint/path function
+async def add_event(session: WriteSessionDep, event: EventCreate): #Endpoint/path function
     #event: EventCreate dice a FastAPI di aspettarsi un oggetto JSON nel body della richiesta e di convertirlo automaticamente in un oggetto EventCreate utilizzando Pydantic
     """Adds a new event to the database""" #questa descrizione appare nella documentazione /docs
     session.add(Event.model_validate(event)) #aggiunge l'oggetto alla sessione del DB
-    session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    await session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    event_cache.invalidate("events:list") #il nuovo evento può comparire in qualsiasi pagina della lista
+    invalidate_counts() #e nelle liste con i conteggi e nelle statistiche
     return "Event successfully added"
 
+@router.post("/bulk") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint POST /events/bulk
+async def add_events_bulk(session: AsyncSessionDep, request: Request): #Endpoint/path function, il corpo è un array JSON o uno stream NDJSON
+    """Adds many events from a JSON array or an NDJSON stream, committing one transaction per chunk of rows.
+    Returns the number of added events and the errors of the rejected rows""" #questa descrizione appare nella documentazione /docs
+    errors, inserted = [], 0
+    with chunked_queries(): #le query di ogni blocco sono le stesse, non vanno segnalate come N+1
+        async for chunk in validated_chunks(request, EventCreate, errors): #righe già validate, a blocchi di config.bulk_chunk_size
+            await session.exec(insert(Event), params=[event.model_dump() for _, event in chunk]) #un solo INSERT con più righe
+            await session.commit() #una transazione per blocco
+            event_cache.invalidate("events:list")
+            invalidate_counts()
+            inserted += len(chunk)
+    return {"inserted": inserted, "errors": errors}
+
 @router.put("/{id}") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint PUT /events/{id}
-def update_event( #Endpoint/path function
-        session: SessionDep,
+async def update_event( #Endpoint/path function
+        session: WriteSessionDep,
         id: Annotated[int, Path(description="The id of the event to update")],
         #Il tipo atteso per l'id è un intero. Path aggiunge una descrizione visibile nella documentazione Swagger.
         new_event: EventCreate #Il nuovo contenuto dell'evento viene ricevuto nel corpo della richiesta come oggetto EventCreate
 ):
     """Updates the event with the given ID""" #questa descrizione appare nella documentazione /docs
-    event = session.get(Event, id) #cerca nel database l'evento con l'ID fornito
+    event = await session.get(Event, id) #cerca nel database l'evento con l'ID fornito
     if not event: #se non esiste nessun evento con l'ID fornito, rende error 404 -> la risorsa richiesta (l'evento con l'ID cercato) non esiste
         raise HTTPException(status_code=404, detail="Event not found") #e viene sollevata un'eccezione
     event.title = new_event.title #se l'evento esiste aggiorna i suoi campi con quelli forniti
@@ -52,51 +248,111 @@ def update_event( #Endpoint/path function
     event.date = new_event.date
     event.location = new_event.location
     session.add(event) #aggiorna l'oggetto che è stato modificato
-    session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione
+    await session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione
+    event_cache.invalidate(f"events:item:{id}", "events:list")
+    invalidate_counts([id])
+    event_broker.publish(id, EVENT_UPDATED, event.model_dump())
     return "Event successfully updated"
 
 @router.delete("/") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint DELETE /events
-def delete_all_events(session: SessionDep): #endpoint/path function
+async def delete_all_events(session: AsyncSessionDep): #endpoint/path function
     """Delete all events""" #questa descrizione appare nella documentazione /docs
-    session.exec(delete(Registration))  #Rimuovo le registrazioni agli eventi
-    session.exec(delete(Event)) #eseguiamo una query di cancellazione SQL -> elimina tutti i record dalla tabella Event
-    session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    await session.exec(delete(Registration))  #Rimuovo le registrazioni agli eventi
+    await session.exec(delete(EventCounter)) #e i loro contatori
+    await session.exec(delete(Event)) #eseguiamo una query di cancellazione SQL -> elimina tutti i record dalla tabella Event
+    await session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    event_cache.invalidate_all()
+    for topic in event_broker.topics():
+        event_broker.publish(topic, EVENT_DELETED, {"id": topic})
     return "All events successfully deleted"
 
 
 @router.delete("/{id}") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint DELETE /events/{id}
-def delete_event_by_id( #endpoint/path function
-        session: SessionDep,
+async def delete_event_by_id( #endpoint/path function
+        session: WriteSessionDep,
         id: int
 ):
     """Delete the event with the given id""" #questa descrizione appare nella documentazione /docs
-    event = session.get(Event, id) #cerca nel database l'evento con l'ID fornito
+    event = await session.get(Event, id) #cerca nel database l'evento con l'ID fornito
     if not event:  #se l'evento non esiste, solleva un'eccezione
         raise HTTPException(status_code=404, detail=f"The event with ID {id} was not found") #404->la risorsa richiesta (l'evento) non esiste
-    session.exec(delete(Registration).where(Registration.event_id == id)) #elimina la registrazione associata all'evento
-    session.delete(event) #se l'evento esiste, lo elimina
-    session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    await session.exec(delete(Registration).where(Registration.event_id == id)) #elimina la registrazione associata all'evento
+    await session.exec(delete(EventCounter).where(EventCounter.event_id == id)) #e il contatore delle registrazioni
+    await session.delete(event) #se l'evento esiste, lo elimina
+    await session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    event_cache.invalidate(f"events:item:{id}", "events:list")
+    invalidate_counts([id])
+    event_broker.publish(id, EVENT_DELETED, {"id": id})
     return f"Event with ID {id} successfully deleted"
 
 
 @router.post("/{id}/register") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint POST /events/{id}/register
-def register_for_event( #endpoint/path function
-        session: SessionDep,
+async def register_for_event( #endpoint/path function
+        session: WriteSessionDep,
         id: Annotated[int, Path(description="The id of the event the user wants to register for")],
         user: User): #passo l'utente nel body della richiesta
-    """Register a user to the event with the given ID"""
-    event = session.get(Event, id) #cerca nel database l'evento con l'ID fornito
-    if not event: #se l'evento non esiste, solleva un'eccezione
-        raise HTTPException(status_code=404, detail="Event not found") #404->la risorsa richiesta non esiste
-    db_user = session.get(User, user.username) #cerca nel database l'utente con il dato username
-    if not db_user: #se l'utente non esiste viene creato
-        db_user = user
-        session.add(db_user)
-        session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
-    registration = Registration(username=db_user.username, event_id=id) #creiamo un oggetto che collega l'utente all'evento tramite username ed event_id
-    session.add(registration) #aggiunge la registrazione alla sessione del DB
-    try:
-        session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Registration failed") #400->Bad Request
+    """Register a user to the event with the given ID, creating the user if it does not exist.
+    User and registration are written in a single transaction"""
+    #crea l'utente solo se non esiste già (INSERT ... ON CONFLICT DO NOTHING), senza leggerlo prima
+    await session.exec(insert_ignore(User).values(username=user.username, name=user.name, email=user.email))
+    #la registrazione viene inserita solo se l'evento esiste e l'utente non è già registrato
+    result = await session.exec(insert_ignore(Registration).from_select(
+        ["username", "event_id"],
+        sa_select(literal(user.username), Event.id).where(Event.id == id),
+    ))
+    if result.rowcount == 0: #nessuna riga inserita: solo ora capiamo il motivo, annullando anche l'eventuale nuovo utente
+        await session.rollback()
+        if not await session.get(Event, id):
+            raise HTTPException(status_code=404, detail="Event not found") #404->la risorsa richiesta non esiste
+        raise HTTPException(status_code=409, detail="User already registered for this event") #409 -> Conflict
+    await add_registrations(session, {id: 1}) #il contatore viene aggiornato nella stessa transazione
+    await session.commit() #un solo commit per utente, registrazione e contatore
+    invalidate_counts([id])
+    event_broker.publish(id, REGISTRATIONS_ADDED, {"event_id": id, "usernames": [user.username]})
     return "User registered successfully"
+
+
+@router.post("/{id}/register/batch") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint POST /events/{id}/register/batch
+async def register_many_for_event( #endpoint/path function
+        session: WriteSessionDep,
+        id: Annotated[int, Path(description="The id of the event the users want to register for")],
+        users: list[User]): #passo la lista degli utenti nel body della richiesta
+    """Register many users to the event with the given ID, creating the users that do not exist.
+    Users and registrations are each written with a single statement in one transaction.
+    Returns for each user whether it was "registered", "already_registered" before, or a "duplicate" of an earlier user of the body"""
+    if len(users) > config.bulk_chunk_size: #limite sul numero di parametri di una singola istruzione SQL
+        raise HTTPException(status_code=413, detail=f"At most {config.bulk_chunk_size} users can be registered in one batch") #413 -> Payload Too Large
+    if not await session.get(Event, id): #se l'evento non esiste, solleva un'eccezione
+        raise HTTPException(status_code=404, detail="Event not found") #404->la risorsa richiesta non esiste
+    unique = {} #un utente ripetuto nel body conta una volta sola (vale il primo)
+    for user in users:
+        unique.setdefault(user.username, user)
+    if not unique:
+        return []
+    await session.exec(insert_ignore(User).values([
+        {"username": user.username, "name": user.name, "email": user.email} for user in unique.values()
+    ]))
+    rows = [{"username": username, "event_id": id} for username in unique]
+    if dialect_name == "mysql": #INSERT IGNORE non supporta RETURNING: le registrazioni esistenti vengono lette (e bloccate) prima
+        existing = set((await session.exec(
+            select(Registration.username).where(Registration.event_id == id, Registration.username.in_(unique)).with_for_update()
+        )).all())
+        await session.exec(insert_ignore(Registration).values(rows))
+        registered = set(unique) - existing
+    else:
+        registered = set((await session.exec(
+            insert_ignore(Registration).values(rows).returning(Registration.username)
+        )).scalars().all()) #RETURNING restituisce solo le registrazioni effettivamente inserite
+    await add_registrations(session, {id: len(registered)})
+    await session.commit()
+    invalidate_counts([id])
+    if registered:
+        event_broker.publish(id, REGISTRATIONS_ADDED, {"event_id": id, "usernames": [username for username in unique if username in registered]})
+    statuses, seen = [], set()
+    for user in users: #le ripetizioni successive alla prima sono segnalate come duplicati
+        if user.username in seen:
+            statuses.append({"username": user.username, "status": "duplicate"})
+        else:
+            seen.add(user.username)
+            statuses.append({"username": user.username, "status": "registered" if user.username in registered else "already_registered"})
+    return statuses
@@ -1,32 +1,96 @@
-from fastapi import APIRouter, HTTPException, Query #Usiamo la classe APIRouter al posto di FastAPI quando costruiamo parti modulari dell'app. Path serve per specificare i parametri nel URL. HTTPException per gestire le eccezioni.
-from sqlmodel import select #select è una funzione di costruzione delle query di SQLModel
+from fastapi import APIRouter, HTTPException, Query, Request, Response #Usiamo la classe APIRouter al posto di FastAPI quando costruiamo parti modulari dell'app. Path serve per specificare i parametri nel URL. HTTPException per gestire le eccezioni.
+from sqlmodel import select, insert, delete, tuple_ #select, insert e delete sono funzioni di costruzione delle query di SQLModel
 from typing import Annotated #per annotare i tipi
-from app.data.db import SessionDep #SessionDep è un alias di tipo per l’iniezione di dipendenza di FastAPI. Per aprire e chiudere automaticamente una Session (connetterci al DB)
+from app.data.db import AsyncSessionDep #AsyncSessionDep è un alias di tipo per l’iniezione di dipendenza di FastAPI. Per aprire e chiudere automaticamente una sessione asincrona (connetterci al DB)
+from app.data.writer import WriteSessionDep #sessione delle scritture singole, che con WRITE_COALESCING passano dalla coda di scrittura
+from app.data.pagination import PageDep, paginate #paginazione keyset con cursore opaco
+from app.data.bulk import validated_chunks, ndjson_export, row_error #inserimento a blocchi ed export NDJSON
+from app.metrics import chunked_queries #i blocchi ripetono le stesse query per costruzione
+from app.data.broker import event_broker, REGISTRATIONS_ADDED, REGISTRATIONS_REMOVED #notifiche ai client collegati allo stream degli eventi
+from app.data.counters import add_registrations, invalidate_counts #contatori delle registrazioni per evento
 from app.models.registration import Registration #import necessario per usare la classe Registration definita nel package models nel file python registration.py
+from app.models.event import Event #per controllare che gli eventi delle registrazioni esistano
+from app.models.user import User #per controllare che gli utenti delle registrazioni esistano
 
 router = APIRouter(prefix="/registrations", tags=["registrations"]) #Inizializzazione del router.Tutti gli endpoint definiti saranno sotto il path /registrations. Il tag "registrations" sarà utilizzato nella documentazione Swagger
 
 @router.get("/") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /registrations
-def get_registrations(session: SessionDep)->list[Registration]: #endpoint/path function, restituisce una lista di oggetti Registration
-    """Returns the list of all registrations"""
-    registration = session.exec(select(Registration)).all() #eseguiamo una query che seleziona tutte le registrazioni
-    return registration
+async def get_registrations( #endpoint/path function, restituisce una pagina di oggetti Registration
+        session: AsyncSessionDep,
+        page: PageDep,
+        response: Response,
+        username: Annotated[str | None, Query(description="Only registrations of this user")] = None,
+        event_id: Annotated[int | None, Query(description="Only registrations for this event")] = None,
+)->list[Registration]:
+    """Returns a page of registrations, optionally filtered by username or event.
+    The cursor of the next page, if any, is returned in the X-Next-Cursor header"""
+    statement = select(Registration) #query che seleziona le registrazioni, a cui aggiungiamo i filtri richiesti
+    if username is not None:
+        statement = statement.where(Registration.username == username)
+    if event_id is not None:
+        statement = statement.where(Registration.event_id == event_id)
+    #l'ordinamento segue la chiave primaria composta (username, event_id)
+    return await paginate(session, statement, [Registration.username, Registration.event_id], page, response, fields=[Registration.username, Registration.event_id])
+
+@router.get("/export") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /registrations/export
+async def export_registrations(): #endpoint/path function, restituisce uno stream NDJSON
+    """Streams all registrations as NDJSON, one registration per line"""
+    return ndjson_export(Registration, [Registration.username, Registration.event_id])
+
+@router.post("/bulk") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint POST /registrations/bulk
+async def add_registrations_bulk(session: AsyncSessionDep, request: Request): #Endpoint/path function, il corpo è un array JSON o uno stream NDJSON
+    """Adds many registrations from a JSON array or an NDJSON stream, committing one transaction per chunk of rows.
+    Rows referring to a missing user or event, or already registered, are rejected.
+    Returns the number of added registrations and the errors of the rejected rows"""
+    errors, inserted = [], 0
+    with chunked_queries(): #le query di ogni blocco sono le stesse, non vanno segnalate come N+1
+        async for chunk in validated_chunks(request, Registration, errors): #righe già validate, a blocchi di config.bulk_chunk_size
+            #tre query per blocco: utenti esistenti, eventi esistenti e registrazioni già presenti
+            users = set((await session.exec(select(User.username).where(User.username.in_({r.username for _, r in chunk})))).all())
+            events = set((await session.exec(select(Event.id).where(Event.id.in_({r.event_id for _, r in chunk})))).all())
+            pairs = {(r.username, r.event_id) for _, r in chunk}
+            existing = set((await session.exec(
+                select(Registration.username, Registration.event_id).where(tuple_(Registration.username, Registration.event_id).in_(pairs))
+            )).all())
+            rows = []
+            for row, registration in chunk:
+                key = (registration.username, registration.event_id)
+                if registration.username not in users:
+                    errors.append(row_error(row, "User not found"))
+                elif registration.event_id not in events:
+                    errors.append(row_error(row, "Event not found"))
+                elif key in existing: #già presente nel database o ripetuta nel corpo
+                    errors.append(row_error(row, "Registration already exists"))
+                else:
+                    existing.add(key)
+                    rows.append(registration.model_dump())
+            if rows:
+                added: dict[int, list[str]] = {} #username aggiunti, raggruppati per evento
+                for row in rows:
+                    added.setdefault(row["event_id"], []).append(row["username"])
+                await session.exec(insert(Registration), params=rows) #un solo INSERT con più righe
+                await add_registrations(session, {event_id: len(usernames) for event_id, usernames in added.items()})
+                await session.commit() #una transazione per blocco, con i contatori
+                invalidate_counts(added)
+                inserted += len(rows)
+                for event_id, usernames in added.items():
+                    event_broker.publish(event_id, REGISTRATIONS_ADDED, {"event_id": event_id, "usernames": usernames})
+    return {"inserted": inserted, "errors": sorted(errors, key=lambda error: error["row"])}
 
 @router.delete("/") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint DELETE /registrations
-def delete_registration_by_username_and_event_id( #endpoint/path function
+async def delete_registration_by_username_and_event_id( #endpoint/path function
         event_id: Annotated[int, Query(description="The id of the event to delete")], #Il tipo atteso per l'id è un intero. Path aggiunge una descrizione visibile nella documentazione Swagger.
         username: Annotated[str, Query(description="The username of the person to delete")],
-        session: SessionDep
+        session: WriteSessionDep
 ):
     """Delete the registration with the given ID and the given username""" #questa descrizione appare nella documentazione /docs
-    registration = session.exec( #eseguiamo una query che seleziona tutte le registrazioni con lo username dato e l'ID evento dato
-        select(Registration).where(
-            Registration.username == username,
-            Registration.event_id == event_id
-        )
-    ).first()
-    if not registration: #se la registrazione non esiste
+    result = await session.exec( #elimina la registrazione con lo username e l'ID evento dati, senza leggerla prima
+        delete(Registration).where(Registration.username == username, Registration.event_id == event_id)
+    )
+    if result.rowcount == 0: #nessuna riga eliminata: la registrazione non esiste (o una richiesta concorrente l'ha già eliminata)
         raise HTTPException(status_code=404, detail="Registration not found") #error 404-> la risorsa richiesta (la registrazione) non esiste
-    session.delete(registration) #Rimuovo le registrazioni
-    session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    await add_registrations(session, {event_id: -1}) #il contatore viene aggiornato nella stessa transazione, solo se la riga è stata eliminata
+    await session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    invalidate_counts([event_id])
+    event_broker.publish(event_id, REGISTRATIONS_REMOVED, {"event_id": event_id, "usernames": [username]})
     return f"Registration of {username} for event {event_id} deleted successfully"
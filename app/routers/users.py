@@ -1,7 +1,15 @@
-from fastapi import APIRouter, Path, HTTPException #Usiamo la classe APIRouter al posto di FastAPI quando costruiamo parti modulari dell'app. Path serve per specificare i parametri nel URL. HTTPException per gestire le eccezioni.
-from sqlmodel import select, delete #select e delete sono funzioni di costruzione/eliminazione delle query di SQLModel
+from fastapi import APIRouter, Path, HTTPException, Request, Response #Usiamo la classe APIRouter al posto di FastAPI quando costruiamo parti modulari dell'app. Path serve per specificare i parametri nel URL. HTTPException per gestire le eccezioni.
+from sqlmodel import select, delete, insert #select, delete e insert sono funzioni di costruzione delle query di SQLModel
 from typing import Annotated #per annotare i tipi
-from app.data.db import SessionDep #SessionDep è un alias di tipo per l’iniezione di dipendenza di FastAPI. Per aprire e chiudere automaticamente una Session (connetterci al DB)
+from app.data.db import AsyncSessionDep, dialect_name #AsyncSessionDep è un alias di tipo per l’iniezione di dipendenza di FastAPI. Per aprire e chiudere automaticamente una sessione asincrona (connetterci al DB)
+from app.data.writer import WriteSessionDep #sessione delle scritture singole, che con WRITE_COALESCING passano dalla coda di scrittura
+from app.data.pagination import PageDep, paginate #paginazione keyset con cursore opaco
+from app.data.bulk import validated_chunks, ndjson_export, row_error #inserimento a blocchi ed export NDJSON
+from app.metrics import chunked_queries #i blocchi ripetono le stesse query per costruzione
+from app.data.broker import event_broker, RESYNC, REGISTRATIONS_REMOVED #notifiche ai client collegati allo stream degli eventi
+from app.data.counters import add_registrations, invalidate_counts #contatori delle registrazioni per evento
+from app.data.cache import event_cache #le risposte sugli eventi con i conteggi vanno invalidate
+from app.models.event import EventCounter
 from app.models.registration import Registration #import necessario per usare la classe Registration definita nel package models nel file python registration.py
 from app.models.user import User, UserCreate #import necessario per usare la classe User definita nel package models nel file python user.py
 
@@ -9,50 +17,108 @@ router = APIRouter(prefix="/users", tags=["users"]) #Inizializzazione del router
 
 
 @router.get("/") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /users
-def get_all_users(session: SessionDep)->list[User]:  #endpoint/path function, restituisce una lista di oggetti User
-    """Returns the list of all users""" #questa descrizione appare nella documentazione /docs
-    users = session.exec(select(User)).all() #eseguiamo una query che seleziona tutti gli utenti
-    return users
+async def get_all_users(session: AsyncSessionDep, page: PageDep, response: Response)->list[User]:  #endpoint/path function, restituisce una pagina di oggetti User
+    """Returns a page of users ordered by username.
+    The cursor of the next page, if any, is returned in the X-Next-Cursor header""" #questa descrizione appare nella documentazione /docs
+    return await paginate(session, select(User), [User.username], page, response, fields=[User.username, User.name, User.email]) #la chiave primaria fa da chiave di ordinamento
+
+@router.get("/export") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /users/export (prima di /{username})
+async def export_users(): #endpoint/path function, restituisce uno stream NDJSON
+    """Streams all users as NDJSON, one user per line""" #questa descrizione appare nella documentazione /docs
+    return ndjson_export(User, [User.username])
 
 @router.get("/{username}") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /users/{id}
-def get_user_by_username( #endpoint/path function, restituisce oggetto User
-        session: SessionDep,
+async def get_user_by_username( #endpoint/path function, restituisce oggetto User
+        session: AsyncSessionDep,
         username: Annotated[str, Path(description="The username of the user to get")]
 )->User:
     """Returns the user with the given username""" #questa descrizione appare nella documentazione /docs
-    user = session.get(User, username) #Cerca l'utente con lo username dato
+    user = await session.get(User, username) #Cerca l'utente con lo username dato
     if not user: #se l'utente non esiste viene sollevata un'eccezione
         raise HTTPException(status_code=404, detail="User not found") #404->la risorsa richiesta (l'utente con lo username cercato) non esiste
     return user
 
+@router.get("/{username}/registrations") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint GET /users/{username}/registrations
+async def get_user_registrations( #endpoint/path function, restituisce una pagina di oggetti Registration
+        session: AsyncSessionDep,
+        username: Annotated[str, Path(description="The username of the user whose registrations to get")],
+        page: PageDep,
+        response: Response,
+)->list[Registration]:
+    """Returns a page of registrations of the user with the given username, ordered by event ID""" #questa descrizione appare nella documentazione /docs
+    if not await session.get(User, username): #se l'utente non esiste viene sollevata un'eccezione
+        raise HTTPException(status_code=404, detail="User not found") #404->la risorsa richiesta non esiste
+    statement = select(Registration).where(Registration.username == username) #scansione per intervallo sul prefisso della chiave primaria
+    return await paginate(session, statement, [Registration.event_id], page, response, fields=[Registration.username, Registration.event_id])
+
 @router.post("/") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint POST /users
-def add_user(session: SessionDep, user: UserCreate): #Endpoint/path function
+async def add_user(session: WriteSessionDep, user: UserCreate): #Endpoint/path function
     """Adds a new user""" #questa descrizione appare nella documentazione /docs
-    existing = session.get(User, user.username) #Cerca l'utente con lo username dato
+    existing = await session.get(User, user.username) #Cerca l'utente con lo username dato
     if existing: #se esiste già uno username con lo username dato viene sollevata un'eccezione
         raise HTTPException(status_code=409, detail="User already exists") #409 -> Conflict
     session.add(User.model_validate(user)) #aggiunge l'oggetto alla sessione del DB
-    session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    await session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
     return "User successfully added"
 
+@router.post("/bulk") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint POST /users/bulk
+async def add_users_bulk(session: AsyncSessionDep, request: Request): #Endpoint/path function, il corpo è un array JSON o uno stream NDJSON
+    """Adds many users from a JSON array or an NDJSON stream, committing one transaction per chunk of rows.
+    Rows whose username already exists are rejected. Returns the number of added users and the errors of the rejected rows""" #questa descrizione appare nella documentazione /docs
+    errors, inserted = [], 0
+    with chunked_queries(): #le query di ogni blocco sono le stesse, non vanno segnalate come N+1
+        async for chunk in validated_chunks(request, UserCreate, errors): #righe già validate, a blocchi di config.bulk_chunk_size
+            usernames = [user.username for _, user in chunk]
+            existing = set((await session.exec(select(User.username).where(User.username.in_(usernames)))).all()) #una sola query per blocco
+            rows = []
+            for row, user in chunk:
+                if not user.username:
+                    errors.append(row_error(row, "username: Field required"))
+                elif user.username in existing: #già presente nel database o ripetuto nel corpo
+                    errors.append(row_error(row, "User already exists"))
+                else:
+                    existing.add(user.username)
+                    rows.append(user.model_dump())
+            if rows:
+                await session.exec(insert(User), params=rows) #un solo INSERT con più righe
+                await session.commit() #una transazione per blocco
+                inserted += len(rows)
+    return {"inserted": inserted, "errors": sorted(errors, key=lambda error: error["row"])}
+
 @router.delete("/") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint DELETE /users
-def delete_all_users(session: SessionDep): #endpoint/path function
+async def delete_all_users(session: AsyncSessionDep): #endpoint/path function
     """Delete all users""" #questa descrizione appare nella documentazione /docs
-    session.exec(delete(Registration))  #Rimuovo le registrazioni degli utenti
-    session.exec(delete(User))  # eseguiamo una query di cancellazione SQL -> elimina tutti i record dalla tabella User
-    session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    await session.exec(delete(Registration))  #Rimuovo le registrazioni degli utenti
+    await session.exec(delete(EventCounter)) #senza registrazioni tutti i contatori valgono 0
+    await session.exec(delete(User))  # eseguiamo una query di cancellazione SQL -> elimina tutti i record dalla tabella User
+    await session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    event_cache.invalidate_all() #i conteggi di tutti gli eventi sono cambiati
+    for topic in event_broker.topics(): #tutte le registrazioni sono state eliminate: i client ricaricano la lista
+        event_broker.publish(topic, RESYNC, {})
     return "All users successfully deleted"
 
 @router.delete("/{username}") #Decoratore che specifica il metodo HTTP e il percorso. Definisce l'endpoint DELETE /users/{id}
-def delete_user_by_username( #endpoint/path function
-        session: SessionDep,
+async def delete_user_by_username( #endpoint/path function
+        session: WriteSessionDep,
         username: Annotated[str, Path(description="The username of the user to delete")] #Il tipo atteso per lo username è una stringa. Path aggiunge una descrizione visibile nella documentazione Swagger.
 ):
     """Delete the user with the given username""" #questa descrizione appare nella documentazione /docs
-    user = session.get(User, username) #cerca nel database l'utente con lo username fornito
+    user = await session.get(User, username) #cerca nel database l'utente con lo username fornito
     if not user: #se l'utente non esiste solleva un'eccezione
         raise HTTPException(status_code=404, detail="User not found") #404->la risorsa richiesta (l'utente) non esiste
-    session.exec(delete(Registration).where(Registration.username == username)) #elimina la registrazione associata all'utente
-    session.delete(user) #se l'utente esiste, lo elimina
-    session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    if dialect_name == "mysql": #DELETE non supporta RETURNING: gli eventi interessati vengono letti (e bloccati) prima
+        event_ids = (await session.exec(
+            select(Registration.event_id).where(Registration.username == username).with_for_update()
+        )).all()
+        await session.exec(delete(Registration).where(Registration.username == username))
+    else:
+        event_ids = (await session.exec( #elimina le registrazioni associate all'utente, ricavando gli eventi interessati
+            delete(Registration).where(Registration.username == username).returning(Registration.event_id)
+        )).scalars().all()
+    await add_registrations(session, {event_id: -1 for event_id in event_ids}) #i contatori vengono aggiornati nella stessa transazione
+    await session.delete(user) #se l'utente esiste, lo elimina
+    await session.commit() #funzione che rende effettive le modifiche al DB (altrimenti le perderemmo al termine della sessione)
+    invalidate_counts(event_ids)
+    for event_id in event_ids:
+        event_broker.publish(event_id, REGISTRATIONS_REMOVED, {"event_id": event_id, "usernames": [username]})
     return f"User with username {username} successfully deleted"
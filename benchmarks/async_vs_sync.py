@@ -0,0 +1,83 @@
+"""Compares requests/sec of the sync and async database engines.
+
+For each mode a uvicorn server is started on a copy of the database, then many
+concurrent clients call the read endpoints for a fixed time.
+
+Run from the project root with:
+    python -m benchmarks.async_vs_sync --concurrency 200 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+
+async def _wait_ready(client: httpx.AsyncClient) -> None:
+    for _ in range(100):
+        try:
+            await client.get("/events/")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("the server did not start")
+
+
+async def _load(base_url: str, concurrency: int, duration: float) -> tuple[int, int]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await _wait_ready(client)
+        event_ids = [event["id"] for event in (await client.get("/events/")).json()] or [1]
+        done = errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def worker(n: int) -> None:
+            nonlocal done, errors
+            while time.perf_counter() < deadline:
+                path = "/events/" if n % 2 else f"/events/{event_ids[done % len(event_ids)]}"
+                response = await client.get(path)
+                done += 1
+                errors += response.status_code >= 500
+
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        return done, errors
+
+
+def run(mode: str, database: Path, port: int, concurrency: int, duration: float) -> float:
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database}", "DB_ASYNC": str(mode == "async").lower()}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        done, errors = asyncio.run(_load(f"http://127.0.0.1:{port}", concurrency, duration))
+    finally:
+        server.terminate()
+        server.wait()
+    throughput = done / duration
+    print(f"{mode:>5}: {throughput:8.1f} req/s ({done} requests, {errors} errors, concurrency {concurrency})")
+    return throughput
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--database", type=Path, default=Path("app/data/database.db"), help="database to copy for the run")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Path(tmp) / "database.db"
+        shutil.copy(args.database, database)
+        results = {mode: run(mode, database, args.port, args.concurrency, args.duration) for mode in ("sync", "async")}
+    print(f"async/sync: {results['async'] / results['sync']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
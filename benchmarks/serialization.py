@@ -0,0 +1,112 @@
+"""Benchmark of the JSON serialization of large list responses.
+
+A database with --rows events and --rows registrations is seeded once, then
+GET /events and GET /registrations are asked for all rows in a single page,
+both through the Pydantic response models (FAST_JSON=false) and through the
+column-tuple serializer that streams pages larger than the bulk chunk size
+(FAST_JSON=true). Each mode runs in its own process, with the cache disabled.
+CPU time and wall time are measured without tracing; peak Python memory is
+measured with tracemalloc in a separate request.
+
+Run from the project root with:
+    python -m benchmarks.serialization --rows 100000 --repeat 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import httpx
+
+ENDPOINTS = ["/events/", "/registrations/"]
+
+
+async def _measure(url: str, repeat: int) -> dict:
+    from app.main import app #importata qui, dopo che il processo figlio ha impostato le variabili d'ambiente
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def get() -> httpx.Response:
+            response = await client.get(url, params={"limit": os.environ["MAX_PAGE_SIZE"]})
+            response.raise_for_status()
+            return response
+        await get() #riscaldamento: connessioni del pool, cache delle query compilate
+        cpu, wall = [], []
+        for _ in range(repeat):
+            c0, w0 = time.process_time(), time.perf_counter()
+            response = await get()
+            cpu.append(time.process_time() - c0)
+            wall.append(time.perf_counter() - w0)
+        del response
+        tracemalloc.start()
+        response = await get()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "endpoint": url,
+        "rows": len(response.json()),
+        "bytes": len(response.content),
+        "cpu_s": statistics.median(cpu),
+        "wall_s": statistics.median(wall),
+        "peak_mib": peak / 2**20,
+    }
+
+
+def _child(mode: str, repeat: int) -> None:
+    for url in ENDPOINTS:
+        print(json.dumps({"mode": mode, **asyncio.run(_measure(url, repeat))}))
+
+
+def _prepare(rows: int, seed: int) -> None:
+    from app.data.db import engine, init_database
+    from app.data.seed import seed_database
+    init_database(with_fake_data=False)
+    seed_database(engine, users=max(rows // 10, 10), events=rows, registrations=rows, seed=seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="events and registrations to seed and to return in one page")
+    parser.add_argument("--repeat", type=int, default=3, help="timed requests per endpoint and mode")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", type=Path, help="also write all results to this file")
+    parser.add_argument("--child", choices=["model", "fast"], help=argparse.SUPPRESS) #modalità eseguita dal processo figlio
+    parser.add_argument("--prepare", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.prepare:
+        _prepare(args.rows, args.seed)
+        return
+    if args.child:
+        _child(args.child, args.repeat)
+        return
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{Path(tmp) / 'bench.db'}",
+            "MAX_PAGE_SIZE": str(args.rows),
+            "CACHE_ENABLED": "false",
+            "METRICS_ENABLED": "false",
+        }
+        command = [sys.executable, "-m", "benchmarks.serialization", "--rows", str(args.rows), "--repeat", str(args.repeat)]
+        subprocess.run([*command, "--prepare", "--seed", str(args.seed)], env=env, check=True)
+        for mode in ("model", "fast"):
+            output = subprocess.run(
+                [*command, "--child", mode], env={**env, "FAST_JSON": str(mode == "fast").lower()}, check=True, capture_output=True, text=True,
+            ).stdout
+            results += [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+    print(f"{'endpoint':<18}{'mode':<7}{'rows':>8}{'MiB out':>9}{'cpu s':>8}{'wall s':>8}{'peak MiB':>10}")
+    for r in results:
+        print(f"{r['endpoint']:<18}{r['mode']:<7}{r['rows']:>8}{r['bytes'] / 2**20:>9.1f}{r['cpu_s']:>8.2f}{r['wall_s']:>8.2f}{r['peak_mib']:>10.1f}")
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Benchmark suite that drives every endpoint of the API in-process at several data sizes.
+
+For each size a fresh database is seeded with app.data.seed (size registrations,
+size/10 users and size/100 events) and every endpoint is called --requests
+times through an in-process ASGI client. Latency percentiles and sequential
+throughput are reported per endpoint.
+
+Run from the project root with:
+    python -m benchmarks.suite --sizes 1000 10000 100000 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+
+def _scenarios(event_ids: list[int], usernames: list[str], page_two: str) -> list[tuple[str, object]]:
+    """Returns (name, request factory) pairs; each factory gets the iteration number and returns (method, url, request kwargs).
+    Endpoints that create data come before the ones that delete it, and the "delete all" endpoints run last"""
+    def event(i: int) -> dict:
+        return {"title": f"Bench event {i}", "description": "Benchmark", "date": "2026-01-01T10:00:00Z", "location": "Bench"}
+
+    def user(prefix: str, i: int) -> dict:
+        return {"username": f"{prefix}{i}", "name": "Bench User", "email": f"{prefix}{i}@example.com"}
+
+    def pick(items: list, i: int):
+        return items[i * 7919 % len(items)] #accesso sparso ma deterministico
+
+    return [
+        ("GET /", lambda i: ("GET", "/", {})),
+        ("GET /events_list", lambda i: ("GET", "/events_list", {})),
+        ("GET /event_detail/{id}", lambda i: ("GET", f"/event_detail/{pick(event_ids, i)}", {})),
+        ("GET /users_list", lambda i: ("GET", "/users_list", {})),
+        ("GET /events", lambda i: ("GET", "/events/", {})),
+        ("GET /events?sort=date&location", lambda i: ("GET", "/events/", {"params": {"sort": "date", "order": "desc", "location": "Roma"}})),
+        ("GET /events?after (page 2)", lambda i: ("GET", "/events/", {"params": {"after": page_two}})),
+        ("GET /events?include_counts", lambda i: ("GET", "/events/", {"params": {"include_counts": "true"}})),
+        ("GET /events/stats", lambda i: ("GET", "/events/stats", {"params": {"bucket": ["day", "week", "month", "year"][i % 4]}})),
+        ("GET /events/{id}", lambda i: ("GET", f"/events/{pick(event_ids, i)}", {})),
+        ("GET /events/{id}?include_counts", lambda i: ("GET", f"/events/{pick(event_ids, i)}", {"params": {"include_counts": "true"}})),
+        ("GET /events/{id}/registrations", lambda i: ("GET", f"/events/{pick(event_ids, i)}/registrations", {})),
+        ("GET /events/search", lambda i: ("GET", "/events/search", {"params": {"q": ["festa", "concerto", "roma", "bench"][i % 4]}})),
+        ("GET /events/export", lambda i: ("GET", "/events/export", {})),
+        ("GET /users", lambda i: ("GET", "/users/", {})),
+        ("GET /users/{username}", lambda i: ("GET", f"/users/{pick(usernames, i)}", {})),
+        ("GET /users/{username}/registrations", lambda i: ("GET", f"/users/{pick(usernames, i)}/registrations", {})),
+        ("GET /users/export", lambda i: ("GET", "/users/export", {})),
+        ("GET /registrations", lambda i: ("GET", "/registrations/", {})),
+        ("GET /registrations?event_id", lambda i: ("GET", "/registrations/", {"params": {"event_id": pick(event_ids, i)}})),
+        ("GET /registrations/export", lambda i: ("GET", "/registrations/export", {})),
+        ("POST /events", lambda i: ("POST", "/events/", {"json": event(i)})),
+        ("POST /events/bulk (100 rows)", lambda i: ("POST", "/events/bulk", {"json": [event(i * 100 + j) for j in range(100)]})),
+        ("PUT /events/{id}", lambda i: ("PUT", f"/events/{pick(event_ids, i)}", {"json": event(i)})),
+        ("POST /users", lambda i: ("POST", "/users/", {"json": user("benchuser", i)})),
+        ("POST /users/bulk (100 rows)", lambda i: ("POST", "/users/bulk", {"json": [user("benchbulk", i * 100 + j) for j in range(100)]})),
+        ("POST /events/{id}/register", lambda i: ("POST", f"/events/{event_ids[0]}/register", {"json": user("benchreg", i)})),
+        ("POST /events/{id}/register/batch (50)", lambda i: ("POST", f"/events/{event_ids[1 % len(event_ids)]}/register/batch", {"json": [user("benchbatch", i * 50 + j) for j in range(50)]})),
+        ("POST /registrations/bulk (100 rows)", lambda i: ("POST", "/registrations/bulk", {"json": [
+            {"username": f"benchbulk{i * 100 + j}", "event_id": event_ids[2 % len(event_ids)]} for j in range(100)
+        ]})),
+        ("DELETE /registrations", lambda i: ("DELETE", "/registrations/", {"params": {"username": f"benchreg{i}", "event_id": event_ids[0]}})),
+        ("DELETE /users/{username}", lambda i: ("DELETE", f"/users/benchuser{i}", {})),
+        ("DELETE /events/{id}", lambda i: ("DELETE", f"/events/{pick(event_ids, i)}", {})),
+        ("DELETE /users", lambda i: ("DELETE", "/users/", {})),
+        ("DELETE /events", lambda i: ("DELETE", "/events/", {})),
+    ]
+
+
+async def _drive(requests: int) -> list[dict]:
+    from app.main import app #importata qui, dopo che il processo figlio ha impostato le variabili d'ambiente
+    from app.data.db import engine
+    from app.data.pagination import encode_cursor
+    from sqlalchemy import text
+    with engine.connect() as connection:
+        event_ids = list(connection.execute(text("SELECT id FROM event ORDER BY id")).scalars())
+        usernames = list(connection.execute(text("SELECT username FROM user ORDER BY username")).scalars())
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        page_two = encode_cursor("id:asc", [event_ids[min(99, len(event_ids) - 1)]]) #cursore della seconda pagina di GET /events
+        for name, factory in _scenarios(event_ids, usernames, page_two):
+            count = 1 if name in ("DELETE /users", "DELETE /events") else requests
+            timings, errors = [], 0
+            start = time.perf_counter()
+            for i in range(count):
+                method, url, kwargs = factory(i)
+                t0 = time.perf_counter()
+                response = await client.request(method, url, **kwargs)
+                timings.append(time.perf_counter() - t0)
+                errors += response.status_code >= 500
+            elapsed = time.perf_counter() - start
+            percentiles = statistics.quantiles(timings, n=100, method="inclusive") if len(timings) > 1 else timings * 99
+            results.append({
+                "endpoint": name,
+                "requests": count,
+                "errors": errors,
+                "p50_ms": percentiles[49] * 1000,
+                "p95_ms": percentiles[94] * 1000,
+                "p99_ms": percentiles[98] * 1000,
+                "mean_ms": statistics.fmean(timings) * 1000,
+                "req_per_s": count / elapsed,
+            })
+    return results
+
+
+def _child(size: int, requests: int, seed: int) -> None:
+    from app.data.db import engine, init_database
+    from app.data.seed import seed_database
+    init_database(with_fake_data=False)
+    seed_database(engine, users=max(size // 10, 10), events=max(size // 100, 10), registrations=size, seed=seed)
+    for result in asyncio.run(_drive(requests)):
+        print(json.dumps(result))
+
+
+def _print_table(size: int, results: list[dict]) -> None:
+    print(f"\n== {size} registrations ==")
+    print(f"{'endpoint':<42}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'req/s':>10}{'5xx':>6}")
+    for r in results:
+        print(f"{r['endpoint']:<42}{r['requests']:>6}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['mean_ms']:>10.2f}{r['req_per_s']:>10.1f}{r['errors']:>6}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="numbers of registrations to seed")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the async database engine")
+    parser.add_argument("--no-cache", action="store_true", help="disable the cache of the event reads")
+    parser.add_argument("--json", type=Path, help="also write all results to this file")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS) #dimensione eseguita dal processo figlio
+    args = parser.parse_args()
+    if args.child is not None:
+        _child(args.child, args.requests, args.seed)
+        return
+    report = {}
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp: #ogni dimensione gira in un processo separato, su un database nuovo
+            env = {
+                **os.environ,
+                "DATABASE_URL": f"sqlite:///{Path(tmp) / 'bench.db'}",
+                "DB_ASYNC": str(args.use_async).lower(),
+                "CACHE_ENABLED": str(not args.no_cache).lower(),
+            }
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.suite", "--child", str(size), "--requests", str(args.requests), "--seed", str(args.seed)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+        report[size] = [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+        _print_table(size, report[size])
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compares write throughput with and without the write queue (WRITE_COALESCING).
+
+For each mode a uvicorn server is started on a copy of the database, then for
+each concurrency level that many clients add users and register them to events
+for a fixed time. Every request writes a new row, so any status other than 200
+is an error (e.g. a 500 for "database is locked").
+
+Run from the project root with:
+    python -m benchmarks.write_concurrency --concurrency 1 10 50 100 --duration 5
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.async_vs_sync import _wait_ready
+
+
+class _Connection:
+    """Minimal HTTP/1.1 keep-alive client: with many concurrent writers the load generator itself must stay cheap,
+    since it shares the CPU with the server"""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def post(self, path: str, payload: dict) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode()
+        self.writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        length = int(re.search(rb"(?i)content-length: *(\d+)", head).group(1))
+        await self.reader.readexactly(length)
+        return int(head.split(b" ", 2)[1])
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def _load(port: int, levels: list[int], duration: float, mode: str) -> list[dict]:
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+        await _wait_ready(client)
+        event_ids = [event["id"] for event in (await client.get("/events/")).json()] or [1]
+    names = itertools.count()
+    results = []
+    for concurrency in levels:
+        done = errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def worker(n: int) -> None:
+            nonlocal done, errors
+            connection = _Connection("127.0.0.1", port)
+            try:
+                while time.perf_counter() < deadline:
+                    name = f"{mode}-{next(names)}"
+                    user = {"username": name, "name": name, "email": f"{name}@example.com"}
+                    if n % 2:
+                        status = await connection.post("/users/", user)
+                    else:
+                        status = await connection.post(f"/events/{event_ids[done % len(event_ids)]}/register", user)
+                    done += 1
+                    errors += status != 200
+            finally:
+                connection.close()
+
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        results.append({"concurrency": concurrency, "done": done, "errors": errors})
+    return results
+
+
+def run(coalescing: bool, database: Path, port: int, levels: list[int], duration: float) -> list[dict]:
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database}", "WRITE_COALESCING": str(coalescing).lower(), "CACHE_ENABLED": "false"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stderr=subprocess.DEVNULL, #gli errori delle richieste fallite vengono contati, non stampati
+    )
+    mode = "coalesced" if coalescing else "direct"
+    try:
+        results = asyncio.run(_load(port, levels, duration, mode))
+    finally:
+        server.terminate()
+        server.wait()
+    for r in results:
+        print(f"{mode:>9}: {r['done'] / duration:8.1f} req/s ({r['done']} requests, {r['errors']} errors, concurrency {r['concurrency']})")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--duration", type=float, default=5, help="seconds per concurrency level")
+    parser.add_argument("--database", type=Path, default=Path("app/data/database.db"), help="database to copy for the run")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for coalescing in (False, True):
+            database = Path(tmp) / f"database-{coalescing}.db"
+            shutil.copy(args.database, database)
+            run(coalescing, database, args.port, args.concurrency, args.duration)
+
+
+if __name__ == "__main__":
+    main()
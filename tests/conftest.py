@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+#La configurazione viene letta all'import di app.config: i test usano un database temporaneo e la coda di scrittura
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ["WRITE_COALESCING"] = "true"
+os.environ["CACHE_ENABLED"] = "false"
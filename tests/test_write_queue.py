@@ -0,0 +1,135 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.config import config
+from app.data import writer
+from app.data.db import engine
+from app.data.writer import QueuedSession, WriteQueue
+from app.main import app
+from app.models.user import User
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client: #avvia il lifespan: crea e popola il database
+        yield client
+
+
+@pytest.fixture
+def batch_window():
+    previous = config.write_batch_window_ms
+    config.write_batch_window_ms = 100 #le scritture avviate insieme finiscono nello stesso gruppo
+    yield
+    config.write_batch_window_ms = previous
+
+
+def _user(username: str) -> User:
+    return User(username=username, name=username, email=f"{username}@example.com")
+
+
+def _usernames(prefix: str) -> set[str]:
+    with Session(engine) as session:
+        return set(session.exec(select(User.username).where(User.username.startswith(prefix))).all())
+
+
+async def _add_user(queue: WriteQueue, username: str) -> str: #come POST /users/ attraverso get_write_session
+    session = QueuedSession(queue)
+    try:
+        session.add(_user(username))
+        await session.commit()
+        return "ok"
+    except Exception as error:
+        return type(error).__name__
+    finally:
+        await session.close()
+
+
+def test_request_errors_are_reported_per_request(client):
+    assert client.post("/users/", json={"username": "wq-dup", "name": "a", "email": "a@example.com"}).status_code == 200
+    assert client.post("/users/", json={"username": "wq-dup", "name": "a", "email": "a@example.com"}).status_code == 409
+    assert client.post("/events/999999/register", json={"username": "wq-dup", "name": "a", "email": "a@example.com"}).status_code == 404
+    assert client.delete("/registrations/", params={"event_id": 999999, "username": "wq-dup"}).status_code == 404
+    assert client.delete("/users/wq-missing").status_code == 404
+    #la coda continua a servire le richieste successive
+    assert client.post("/users/", json={"username": "wq-after", "name": "b", "email": "b@example.com"}).status_code == 200
+    assert _usernames("wq-") == {"wq-dup", "wq-after"}
+
+
+def test_constraint_error_rolls_back_only_its_request(client, batch_window):
+    async def main():
+        queue = WriteQueue()
+        try:
+            return await asyncio.gather(*(_add_user(queue, name) for name in ["ce-a1", "ce-a2", "ce-a1", "ce-a3", "ce-a4"]))
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main()) == ["ok", "ok", "IntegrityError", "ok", "ok"]
+    assert _usernames("ce-") == {"ce-a1", "ce-a2", "ce-a3", "ce-a4"}
+
+
+def test_request_cancelled_while_queued(client, batch_window):
+    async def main():
+        queue = WriteQueue()
+        holding, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_writer():
+            session = QueuedSession(queue)
+            try:
+                session.add(_user("cq-first"))
+                await session.flush() #il turno è iniziato: le altre richieste restano in coda
+                holding.set()
+                await release.wait()
+                await session.commit()
+            finally:
+                await session.close()
+
+        first = asyncio.create_task(slow_writer())
+        await holding.wait()
+        cancelled = asyncio.create_task(_add_user(queue, "cq-cancelled"))
+        await asyncio.sleep(0.01)
+        cancelled.cancel() #ad esempio il client si è disconnesso
+        release.set()
+        await first
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        try:
+            return await _add_user(queue, "cq-last")
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main()) == "ok"
+    assert _usernames("cq-") == {"cq-first", "cq-last"}
+
+
+def test_failed_group_commit_fails_every_request(client, batch_window, monkeypatch):
+    failing = True
+    group_session = writer._group_session
+
+    def session_with_failing_commit():
+        session = group_session()
+        commit = session.sync_session.commit
+
+        def fail_once():
+            nonlocal failing
+            if failing:
+                failing = False
+                raise IntegrityError("COMMIT", {}, Exception("disk I/O error"))
+            commit()
+
+        session.sync_session.commit = fail_once
+        return session
+
+    monkeypatch.setattr(writer, "_group_session", session_with_failing_commit)
+
+    async def main():
+        queue = WriteQueue()
+        try:
+            failed = await asyncio.gather(*(_add_user(queue, f"gc-{i}") for i in range(3)))
+            return failed, await _add_user(queue, "gc-next") #il gruppo successivo usa una nuova transazione
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main()) == (["IntegrityError"] * 3, "ok")
+    assert _usernames("gc-") == {"gc-next"}